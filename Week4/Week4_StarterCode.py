@@ -110,7 +110,9 @@ tools = []
 def conversation_with_functions():
     pass
 
-print(get_bitcoin_price())
+# Only run this when the file is run, so other code can import it
+if __name__ == "__main__":
+    print(get_bitcoin_price())
 
-#conversation()
-#conversation_with_functions()
+    #conversation()
+    #conversation_with_functions()
@@ -238,5 +238,7 @@ def conversation_with_functions():
             message_list.append(response)
 
 
-# conversation()
-conversation_with_functions()
+# Only start talking when this file is run, so other code can import it
+if __name__ == "__main__":
+    # conversation()
+    conversation_with_functions()
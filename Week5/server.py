@@ -0,0 +1,13 @@
+# The server now lives in the stockbroker package at the top of the repo, see stockbroker/server.py
+# This file is kept so python Week5/server.py still works, it does the same as python -m stockbroker serve
+# standard python library
+import os
+import sys
+
+# Let python find the stockbroker package, it is one folder up from this file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stockbroker.server import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Load test for the stockbroker's conversation pipeline
+# Starts the local mock servers, points the stockbroker at them, and runs many simulated users at once
+# Usage (from the top of the repo):
+#   python benchmarks/load_test.py --users 100 --turns 10 --llm-latency 0.2 --price-latency 0.05
+# standard python library, everything here is built in
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from mock_servers import MockCryptoCompare, MockOpenAI
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRICE_QUESTIONS = ["What is the price of bitcoin?", "How much is BTC worth right now?"]
+OTHER_QUESTIONS = ["What is a stop-loss order?", "Explain what a limit order is.", "Thanks!"]
+
+
+# Import the stockbroker after the environment points it at the mock servers
+def load_pipeline(openai_url, cryptocompare_url, args):
+    os.environ.setdefault("OPENAI_KEY", "sk-benchmark")
+    os.environ["SESSION_STORE"] = args.session_store
+    # Benchmark sessions go in a throwaway database, not the real one
+    os.environ["SESSION_DB"] = os.path.join(tempfile.mkdtemp(prefix="stockbroker-bench-"), "sessions.db")
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ["CRYPTOCOMPARE_URL"] = cryptocompare_url
+    os.environ["STREAM_RESPONSES"] = "true" if args.stream else "false"
+    os.environ["PRICE_CACHE_TTL"] = str(args.cache_ttl)
+    os.environ["PRICE_FEED"] = "true" if args.price_feed else "false"
+    os.environ["MODEL_ROUTER"] = "true" if args.router else "false"
+    os.environ["RESPONSE_CACHE"] = "true" if args.response_cache else "false"
+    # The mock apis have no limits unless we ask for them, so the pipeline does not pace itself by default either
+    os.environ["OPENAI_RPM"] = str(args.openai_rpm)
+    os.environ["OPENAI_TPM"] = str(args.openai_tpm)
+    os.environ["CRYPTOCOMPARE_RPM"] = str(args.price_rpm)
+    os.environ["DISPLAY_SINK"] = args.display
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module("stockbroker.conversation")
+
+
+# One simulated user: asks `turns` questions one after another, and records how long each one took
+async def simulate_user(pipeline, user_id, turns, price_ratio, latencies, failures):
+    for turn in range(turns):
+        # Spread the price questions evenly instead of randomly, so runs are repeatable
+        if (turn * price_ratio) % 1 + price_ratio >= 1:
+            question = PRICE_QUESTIONS[turn % len(PRICE_QUESTIONS)]
+        else:
+            question = OTHER_QUESTIONS[turn % len(OTHER_QUESTIONS)]
+        start = time.perf_counter()
+        try:
+            await pipeline.handle_turn(f"bench-{user_id}", question)
+        except Exception:
+            failures.append(user_id)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_users(pipeline, users, turns, price_ratio):
+    latencies = []
+    failures = []
+    start = time.perf_counter()
+    pipeline.startup()
+    try:
+        await asyncio.gather(*(simulate_user(pipeline, user_id, turns, price_ratio, latencies, failures)
+                               for user_id in range(users)))
+    finally:
+        await pipeline.shutdown()
+    return latencies, failures, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(args):
+    with MockOpenAI(args.llm_latency, args.llm_error_rate, args.tool_call_rate, args.llm_quota) as openai_server, \
+            MockCryptoCompare(args.price_latency, args.price_error_rate, args.price_quota) as price_server:
+        pipeline = load_pipeline(openai_server.url, price_server.url, args)
+        # The pipeline prints every message, which would drown out the report (and cost time)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            latencies, failures, elapsed = asyncio.run(run_users(pipeline, args.users, args.turns, args.price_ratio))
+        latencies.sort()
+        return {
+            "users": args.users,
+            "turns": len(latencies) + len(failures),
+            "failed_turns": len(failures),
+            "elapsed_s": round(elapsed, 3),
+            "turns_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            },
+            "upstream_calls": {
+                "openai": dict(openai_server.counts),
+                "cryptocompare": dict(price_server.counts),
+            },
+        }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"users: {report['users']}  turns: {report['turns']}  failed: {report['failed_turns']}")
+    print(f"elapsed: {report['elapsed_s']}s  throughput: {report['turns_per_s']} turns/s")
+    print(f"turn latency (ms): mean {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {latency['max']}")
+    for name, counts in report["upstream_calls"].items():
+        print(f"{name} calls: " + ", ".join(f"{key} {value}" for key, value in sorted(counts.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the stockbroker against local mock apis")
+    parser.add_argument("--users", type=int, default=50, help="simulated users talking at the same time")
+    parser.add_argument("--turns", type=int, default=5, help="questions each user asks")
+    parser.add_argument("--price-ratio", type=float, default=0.5, help="fraction of questions that ask for a price")
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="seconds the mock AI takes per request")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of AI requests that fail")
+    parser.add_argument("--tool-call-rate", type=float, default=1.0,
+                        help="fraction of price questions the mock AI answers with a function call")
+    parser.add_argument("--price-latency", type=float, default=0.05, help="seconds the mock price api takes")
+    parser.add_argument("--price-error-rate", type=float, default=0.0, help="fraction of price requests that fail")
+    parser.add_argument("--llm-quota", type=int, default=0,
+                        help="requests a minute the mock AI takes before answering 429, 0 for no limit")
+    parser.add_argument("--price-quota", type=int, default=0,
+                        help="requests a minute the mock price api takes before answering 429, 0 for no limit")
+    parser.add_argument("--openai-rpm", type=float, default=0, help="OPENAI_RPM for the run, 0 turns it off")
+    parser.add_argument("--openai-tpm", type=float, default=0, help="OPENAI_TPM for the run, 0 turns it off")
+    parser.add_argument("--price-rpm", type=float, default=0, help="CRYPTOCOMPARE_RPM for the run, 0 turns it off")
+    parser.add_argument("--cache-ttl", type=float, default=10, help="PRICE_CACHE_TTL for the run, 0 turns it off")
+    parser.add_argument("--session-store", choices=("sqlite", "memory"), default="sqlite",
+                        help="where the pipeline saves sessions during the run")
+    parser.add_argument("--price-feed", action=argparse.BooleanOptionalAction, default=True,
+                        help="keep the prices users ask about up to date in the background")
+    parser.add_argument("--router", action=argparse.BooleanOptionalAction, default=True,
+                        help="answer price questions without the AI and pick a model for the rest")
+    parser.add_argument("--response-cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="reuse the AI's answers to general questions someone already asked")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=False,
+                        help="stream the AI's replies")
+    parser.add_argument("--display", choices=("tty", "plain", "jsonl", "null"), default="plain",
+                        help="DISPLAY_SINK for the run, the messages it prints are thrown away either way")
+    parser.add_argument("--json", action="store_true", help="print the report as one line of json")
+    parser.add_argument("--metrics", action="store_true",
+                        help="also print the pipeline's timing metrics in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+    if args.metrics:
+        print(importlib.import_module("stockbroker.tracing").metrics.render(), end="")
+    return report
+
+
+if __name__ == "__main__":
+    main()
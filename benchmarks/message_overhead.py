@@ -0,0 +1,142 @@
+# Message overhead benchmark for the stockbroker
+# Compares keeping a conversation the way we used to (a dictionary per message, encoded again by the openai library on
+# every call) with Message (see stockbroker/messages.py), which keeps its own json
+# It measures how much memory a session takes, and how much cpu time one call to the AI takes for a long conversation
+# The calls go to the local mock api, so nothing is sent to OpenAI and no key is needed
+# Usage (from the top of the repo):
+#   python benchmarks/message_overhead.py --sessions 1000 --turns 100 --requests 50
+# standard python library, everything here is built in
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from mock_servers import MockOpenAI
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One turn of a typical conversation: the question, what the price function gave back and the AI's answer
+QUESTION = "What are the prices of bitcoin and ethereum right now, and how have they moved today?"
+RESULT = ('{"quotes":[{"symbol":"BTC","price":64123.51,"currency":"USD","time":1718000000,"source":"coinbase"},'
+          '{"symbol":"ETH","price":3512.08,"currency":"USD","time":1718000000,"source":"coinbase"}]}')
+ANSWER = ("Bitcoin is trading at $64,123.51 and ethereum at $3,512.08. Both are up a little today, bitcoin by about "
+          "1.2% and ethereum by about 0.8%, which is well within their usual daily range.")
+
+
+# The text of one turn, numbered so every turn has its own strings like a real conversation would
+def turn_text(turn):
+    return f"{QUESTION} ({turn})", f"{RESULT[:-1]},\"turn\":{turn}}}", f"{ANSWER} ({turn})"
+
+
+# The dictionaries one turn used to add, with the tokens the context window counted for each
+def dict_turn(turn, count_tokens):
+    question, result, answer = turn_text(turn)
+    messages = [{'role': 'user', 'content': question},
+                {"role": "function", "tool_call_id": f"call_{turn}", "name": "get_crypto_prices", "content": result},
+                {'role': 'assistant', 'content': answer}]
+    return [(message, 4 + count_tokens(message["content"])) for message in messages]
+
+
+# The same turn as Messages, the class is passed in since the stockbroker is only imported once the mock api is running
+def message_turn(message_class, turn):
+    question, result, answer = turn_text(turn)
+    return [message_class('user', question),
+            message_class("function", result, tool_call_id=f"call_{turn}", name="get_crypto_prices"),
+            message_class('assistant', answer)]
+
+
+# How many bytes `build` allocates and keeps, per session
+def measure_memory(build, sessions):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(session) for session in range(sessions)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / sessions
+
+
+# The cpu time one call takes, averaged over `requests` calls
+# The mock api runs in this process too, but it does the same work for both ways of sending
+def measure_cpu(call, requests):
+    call()
+    start = time.process_time()
+    for _ in range(requests):
+        call()
+    return (time.process_time() - start) / requests * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the memory and cpu time conversation messages cost")
+    parser.add_argument("--sessions", type=int, default=1000, help="sessions to keep in memory at once")
+    parser.add_argument("--turns", type=int, default=100, help="turns in every session")
+    parser.add_argument("--requests", type=int, default=50, help="calls to the AI to time for each way of sending")
+    parser.add_argument("--json", action="store_true", help="print the report as one line of json")
+    args = parser.parse_args(argv)
+
+    with MockOpenAI(tool_call_rate=0.0) as openai_api:
+        os.environ.setdefault("OPENAI_KEY", "sk-benchmark")
+        os.environ["OPENAI_BASE_URL"] = openai_api.url
+        os.environ["SESSION_STORE"] = "memory"
+        os.environ["PRICE_FEED"] = "false"
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)
+        import openai
+        from stockbroker.completions import create_completion
+        from stockbroker.context_window import ContextWindow, make_token_counter
+        from stockbroker.conversation import system_prompt
+        from stockbroker.messages import Message
+        from stockbroker.tools import tools
+
+        count_tokens = make_token_counter("gpt-3.5-turbo")
+        # A window big enough that nothing gets dropped, so both ways keep every message
+        budget = 10 ** 9
+
+        # The old way: a copy of the system prompt and a deque of (dictionary, tokens) pairs for every session
+        def dict_session(session):
+            turns = deque()
+            for turn in range(args.turns):
+                turns.extend(dict_turn(turn, count_tokens))
+            return dict(system_prompt.to_dict()), turns
+
+        def message_session(session):
+            window = ContextWindow(system_prompt, budget=budget)
+            for turn in range(args.turns):
+                for message in message_turn(Message, turn):
+                    window.append(message)
+            return window
+
+        dict_bytes = measure_memory(dict_session, args.sessions)
+        message_bytes = measure_memory(message_session, args.sessions)
+
+        # One long conversation, sent both ways
+        dict_messages = [system_prompt.to_dict()] + [message for message, _ in dict_session(0)[1]]
+        message_messages = message_session(0).messages()
+        plain_client = openai.OpenAI(api_key=os.environ["OPENAI_KEY"])
+        dict_ms = measure_cpu(lambda: plain_client.chat.completions.create(
+            model="gpt-3.5-turbo", messages=dict_messages, tools=tools), args.requests)
+        message_ms = measure_cpu(lambda: create_completion(
+            model="gpt-3.5-turbo", messages=message_messages, tools=tools), args.requests)
+
+    report = {
+        "sessions": args.sessions,
+        "messages_per_session": 1 + 3 * args.turns,
+        "bytes_per_session": {"dicts": round(dict_bytes), "messages": round(message_bytes)},
+        "cpu_ms_per_request": {"dicts": round(dict_ms, 3), "messages": round(message_ms, 3)},
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"sessions: {report['sessions']}  messages per session: {report['messages_per_session']}")
+        print(f"memory per session: dicts {dict_bytes / 1024:.1f} KiB  messages {message_bytes / 1024:.1f} KiB  "
+              f"({(1 - message_bytes / dict_bytes):.0%} less)")
+        print(f"cpu per request: dicts {dict_ms:.2f} ms  messages {message_ms:.2f} ms  "
+              f"({dict_ms / message_ms:.1f}x faster)")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# Local stand-ins for the CryptoCompare and OpenAI apis
+# They answer the same requests the stockbroker makes, with a configurable delay and error rate,
+# and count every request they get, so we can benchmark without touching the real services
+# standard python library, everything here is built in
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Words in a user message that make the fake AI call a price function
+PRICE_WORDS = ("price", "worth", "cost")
+# The price history endpoints, and the seconds in one of their candles
+HISTORY_STEPS = {"/data/v2/histominute": 60, "/data/v2/histohour": 3600, "/data/v2/histoday": 86400}
+
+
+# The standard library server only queues 5 connections, which is far too few for a load test
+class BenchmarkHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+# Shared bits for both servers: a latency, an error rate, a rate limit and request counters
+# quota is how many requests a minute the server takes before answering 429 like the real apis, 0 means no limit
+# It is checked every second, so at most quota / 60 requests go through in any one second
+class MockServer:
+    def __init__(self, handler, latency=0.0, error_rate=0.0, error_status=500, quota=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.quota = quota
+        self._window = (0, 0)
+        self.counts = {}
+        self._counts_lock = threading.Lock()
+        self._random = random.Random(0)
+        self._random_lock = threading.Lock()
+        self.httpd = BenchmarkHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def should_fail(self):
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    # Count a request against this second's share of the quota, returns False if it is over
+    def within_quota(self):
+        if not self.quota:
+            return True
+        with self._counts_lock:
+            second, used = self._window
+            now = int(time.monotonic())
+            if now != second:
+                second, used = now, 0
+            self._window = (second, used + 1)
+            return used < max(1, self.quota // 60)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests, like the real apis do
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Sleep for the configured latency, and answer with an error instead if this request should fail
+    # Returns True if we already sent an error
+    def simulate(self):
+        if not self.mock.within_quota():
+            self.mock.count("rate_limited")
+            data = json.dumps({"error": {"message": "rate limit reached", "type": "requests"}}).encode()
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(data)
+            return True
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        if self.mock.should_fail():
+            self.mock.count("errors")
+            self.send_json(self.mock.error_status, {"error": {"message": "mock failure", "type": "server_error"}})
+            return True
+        return False
+
+    # Don't print a line for every request
+    def log_message(self, format, *args):
+        pass
+
+
+# The CryptoCompare endpoints we use: generateAvg for one coin, pricemultifull for many,
+# and histominute/histohour/histoday for price history
+class CryptoCompareHandler(MockHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.mock.count(url.path)
+        if self.simulate():
+            return
+        if url.path == "/data/generateAvg":
+            self.send_json(200, {"RAW": self.quote(query["fsym"], query.get("tsym", "USD"))})
+        elif url.path == "/data/pricemultifull":
+            tsym = query.get("tsyms", "USD")
+            self.send_json(200, {"RAW": {fsym: {tsym: self.quote(fsym, tsym)} for fsym in query["fsyms"].split(",")}})
+        elif url.path in HISTORY_STEPS:
+            self.send_json(200, {"Response": "Success", "Data": {"Data": self.history(
+                query["fsym"], HISTORY_STEPS[url.path], int(query.get("limit", 30)),
+                int(query.get("toTs", time.time())))}})
+        else:
+            self.send_json(404, {"Response": "Error", "Message": "unknown path"})
+
+    # A made up but stable price for each coin
+    def quote(self, fsym, tsym):
+        price = round(sum(map(ord, fsym)) * 97.13, 2)
+        return {"FROMSYMBOL": fsym, "TOSYMBOL": tsym, "PRICE": price, "LASTUPDATE": int(time.time())}
+
+    # limit + 1 made up candles ending at to_ts, the price wobbles around the coin's quote so it is the same every run
+    def history(self, fsym, step, limit, to_ts):
+        base = sum(map(ord, fsym)) * 97.13
+        end = to_ts // step * step
+        bars = []
+        for bar_time in range(end - limit * step, end + 1, step):
+            close = round(base * (1 + 0.05 * math.sin(bar_time / step / 7)), 2)
+            bars.append({"time": bar_time, "open": round(close * 0.995, 2), "high": round(close * 1.01, 2),
+                         "low": round(close * 0.985, 2), "close": close, "volumefrom": 100.0,
+                         "volumeto": round(close * 100, 2)})
+        return bars
+
+
+class MockCryptoCompare(MockServer):
+    def __init__(self, latency=0.0, error_rate=0.0, quota=0):
+        super().__init__(CryptoCompareHandler, latency, error_rate, quota=quota)
+
+
+# The chat completions endpoint
+# If tools were sent and the user asked about a price, the fake AI calls get_crypto_price (tool_call_rate of the time)
+# otherwise it answers with a short sentence, streamed or not depending on what was asked for
+class ChatCompletionsHandler(MockHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.mock.count(self.path)
+        if self.simulate():
+            return
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self.complete(body)
+        else:
+            self.send_json(404, {"error": {"message": "unknown path"}})
+
+    def complete(self, body):
+        # Count the requests each model got too, so a run shows where the router sent the turns
+        self.mock.count(f"model {body['model']}")
+        messages = body["messages"]
+        last = messages[-1]
+        tool_calls = None
+        content = None
+        if body.get("tools") and last["role"] == "user" and self.mock.wants_tool_call(last["content"]):
+            self.mock.count("tool_calls")
+            tool_calls = [{
+                "index": 0,
+                "id": f"call_{self.mock.next_id()}",
+                "type": "function",
+                "function": {"name": "get_crypto_price",
+                             "arguments": json.dumps({"currency": "Bitcoin", "currency_code": "BTC"})},
+            }]
+        elif last["role"] == "function":
+            content = f"Here you go: {last['content']}"
+        else:
+            content = "This is a mock reply from the local benchmark server."
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+        completion_tokens = len(content or "") // 4 + (10 if tool_calls else 0)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            self.stream(body["model"], content, tool_calls, finish_reason, usage if include_usage else None)
+            return
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = [{key: value for key, value in call.items() if key != "index"}
+                                     for call in tool_calls]
+        self.send_json(200, {
+            "id": f"chatcmpl-{self.mock.next_id()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage,
+        })
+
+    # Send the reply as server sent events, a few words per chunk, like the real api does
+    # If usage is given, it is sent in one last chunk with no choices, like the api does with include_usage
+    def stream(self, model, content, tool_calls, finish_reason, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_id = f"chatcmpl-{self.mock.next_id()}"
+
+        def send(delta, finish=None):
+            event = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.write_chunk(f"data: {json.dumps(event)}\n\n")
+
+        send({"role": "assistant", "content": ""})
+        if tool_calls:
+            send({"tool_calls": tool_calls})
+        else:
+            words = content.split(" ")
+            for index in range(0, len(words), 3):
+                send({"content": " ".join(words[index:index + 3]) + (" " if index + 3 < len(words) else "")})
+        send({}, finish_reason)
+        if usage:
+            event = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [], "usage": usage}
+            self.write_chunk(f"data: {json.dumps(event)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.write_chunk("")
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockOpenAI(MockServer):
+    def __init__(self, latency=0.0, error_rate=0.0, tool_call_rate=1.0, quota=0):
+        super().__init__(ChatCompletionsHandler, latency, error_rate, quota=quota)
+        self.tool_call_rate = tool_call_rate
+        self._ids = 0
+
+    @property
+    def url(self):
+        return super().url + "/v1"
+
+    def next_id(self):
+        with self._counts_lock:
+            self._ids += 1
+            return self._ids
+
+    def wants_tool_call(self, text):
+        if not any(word in text.lower() for word in PRICE_WORDS):
+            return False
+        with self._random_lock:
+            return self._random.random() < self.tool_call_rate
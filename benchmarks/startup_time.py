@@ -0,0 +1,99 @@
+# Startup time benchmark for the stockbroker
+# Imports the stockbroker in fresh python processes, the way a worker, a test or the command line would,
+# and checks that the slow packages (openai, requests, httpx, numpy) are not loaded until something uses them
+# Usage (from the top of the repo):
+#   python benchmarks/startup_time.py --runs 10 --max-import-ms 500
+# It exits with an error if a slow package gets imported at startup or the import is slower than --max-import-ms
+# standard python library, everything here is built in
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages that take a long time to import and should wait until they are needed
+DEFERRED_MODULES = ("openai", "requests", "httpx", "numpy")
+
+# Runs in the child process: time the import, then see which slow packages really got loaded
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import stockbroker.conversation
+imported = time.perf_counter()
+loaded = [name for name in {deferred!r}
+          if name in sys.modules and type(sys.modules[name]).__name__ != "_LazyModule"]
+if {make_client!r}:
+    stockbroker.clients.get_openai_client()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "client_ms": (time.perf_counter() - imported) * 1000,
+                  "loaded": loaded}}))
+"""
+
+
+# Start one fresh python, returns what it measured plus how long the whole process took
+def run_once(make_client):
+    env = dict(os.environ)
+    # No api key, importing should not need one
+    env.pop("OPENAI_KEY", None)
+    if make_client:
+        env["OPENAI_KEY"] = "sk-startup-benchmark"
+    env["SESSION_DB"] = os.path.join(tempfile.gettempdir(), "stockbroker-startup.db")
+    env["PRICE_HISTORY_DIR"] = os.path.join(tempfile.gettempdir(), "stockbroker-startup-history")
+    code = CHILD.format(deferred=DEFERRED_MODULES, make_client=make_client)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def summarize(results, key):
+    values = sorted(result[key] for result in results)
+    return {"median": round(statistics.median(values), 1), "min": round(values[0], 1), "max": round(values[-1], 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long the stockbroker takes to start")
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes to start for each measurement")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="fail if the median import of the stockbroker takes longer than this")
+    parser.add_argument("--json", action="store_true", help="print the report as one line of json")
+    args = parser.parse_args(argv)
+
+    imports = [run_once(make_client=False) for _ in range(args.runs)]
+    clients = [run_once(make_client=True) for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "import_ms": summarize(imports, "import_ms"),
+        "process_ms": summarize(imports, "process_ms"),
+        "first_client_ms": summarize(clients, "client_ms"),
+        "loaded_at_import": sorted({name for result in imports for name in result["loaded"]}),
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"runs: {report['runs']}")
+        for name in ("import_ms", "process_ms", "first_client_ms"):
+            stats = report[name]
+            print(f"{name}: median {stats['median']}  min {stats['min']}  max {stats['max']}")
+        print(f"slow packages loaded at import: {', '.join(report['loaded_at_import']) or 'none'}")
+
+    failed = False
+    if report["loaded_at_import"]:
+        print(f"FAIL: {', '.join(report['loaded_at_import'])} should only be imported when first used", file=sys.stderr)
+        failed = True
+    if args.max_import_ms is not None and report["import_ms"]["median"] > args.max_import_ms:
+        print(f"FAIL: importing took {report['import_ms']['median']}ms, the limit is {args.max_import_ms}ms",
+              file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
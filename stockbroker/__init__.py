@@ -0,0 +1,7 @@
+# The stockbroker: an AI assistant that can look up cryptocurrency prices, price history, indicators and portfolios
+# Run it with python -m stockbroker from the top of the repo, see __main__.py
+# pip install python-dotenv
+from dotenv import load_dotenv
+
+# Load the .env file before anything in the package reads its settings from the environment
+load_dotenv()
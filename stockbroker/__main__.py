@@ -0,0 +1,29 @@
+# Run the stockbroker from the command line, from the top of the repo:
+#   python -m stockbroker           talk to it in the terminal, it can call functions to look up prices
+#   python -m stockbroker chat      the plain chat from the first weeks, without functions
+#   python -m stockbroker serve     serve it to many people at once over HTTP and WebSockets, see server.py
+# standard python library
+import argparse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m stockbroker", description="Talk to the stockbroker")
+    parser.add_argument("command", nargs="?", default="functions", choices=("functions", "chat", "serve"),
+                        help="what to run, the terminal conversation with functions by default")
+    args, rest = parser.parse_known_args(argv)
+    # Only import what the command needs, the server's own options are passed on to it
+    if args.command == "serve":
+        from .server import main as serve
+        serve(rest)
+        return
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    from .conversation import conversation, conversation_with_functions
+    if args.command == "chat":
+        conversation()
+    else:
+        conversation_with_functions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# The OpenAI clients, shared by everything in the package
+# standard python library
+import os
+# Puts off slow imports and making the clients until they are needed, see lazy.py
+from .lazy import lazy_import, once
+# pip install openai, only imported the first time we make a client, it takes most of a second to import
+openai = lazy_import("openai")
+
+
+# A request body we already made into json ourselves, e.g. a conversation whose messages keep their own json (see messages.py)
+class EncodedJSON:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+# The openai versions the EncodedJSON path was checked against
+# It relies on client.post() and the http client's build_request(), which are not part of openai's documented api,
+# so with any other version we send requests with chat.completions.create() like everyone else
+ENCODED_JSON_VERSIONS = ("1.17.",)
+
+
+# Whether requests to the AI are sent as EncodedJSON, ENCODED_REQUESTS=false in the .env file turns it off
+@once
+def encoded_requests():
+    if os.environ.get("ENCODED_REQUESTS", "true").lower() not in ("1", "true", "yes"):
+        return False
+    return openai.__version__.startswith(ENCODED_JSON_VERSIONS)
+
+
+# The openai library hands the body of a request to httpx, which makes it into json
+# These http clients send an EncodedJSON body as it is instead, every other request goes through like normal
+# The class is made when the first client is, since httpx and openai are only imported then
+def encoded_json_client(base):
+    class EncodedJSONClient(base):
+        def build_request(self, method, url, *, json=None, **kwargs):
+            if isinstance(json, EncodedJSON):
+                return super().build_request(method, url, content=json.text.encode(), **kwargs)
+            return super().build_request(method, url, json=json, **kwargs)
+    return EncodedJSONClient
+
+
+# Create a .env file and store your api key in it
+# OPENAI_KEY = "sk-..."
+# The clients are made the first time we talk to the AI, so code that only needs the price functions
+# does not need an api key and does not wait for the openai package to load
+# There is one of each for the whole process, so every session shares its connection pool
+# The OpenAI client reads OPENAI_BASE_URL itself, so both apis can be pointed at local stand-ins for benchmarking
+@once
+def get_openai_client():
+    return openai.OpenAI(api_key=os.environ['OPENAI_KEY'],
+                         http_client=encoded_json_client(openai.DefaultHttpxClient)() if encoded_requests() else None)
+
+
+# The async version of the client, every call on it has to be awaited
+@once
+def get_async_openai_client():
+    return openai.AsyncOpenAI(api_key=os.environ['OPENAI_KEY'],
+                              http_client=encoded_json_client(openai.DefaultAsyncHttpxClient)()
+                              if encoded_requests() else None)
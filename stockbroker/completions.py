@@ -0,0 +1,187 @@
+# Calls to the AI, streamed or not, with every call timed under a span
+# standard python library
+import os
+import time
+from types import SimpleNamespace
+
+from .clients import openai, get_openai_client, get_async_openai_client, EncodedJSON, encoded_requests
+# The streamed reply is printed through the same renderer as every other message, see display.py
+from .display import print_stream_chunk, print_stream_end
+# Messages keep their own json, so a request only encodes what is new, see messages.py
+from .messages import Message, dumps, encode, encode_messages
+# Keeps us under the AI's requests and tokens per minute, see rate_limit.py
+from .rate_limit import openai_limits
+from .tracing import span, record_usage
+
+# Print the AI's replies while they are being written instead of waiting for the whole thing
+# Set STREAM_RESPONSES=false in the .env file to wait for the full reply like before
+stream_responses = os.environ.get("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+
+
+# Builds up a streamed reply one chunk at a time
+# With stream=True the api sends the reply in small pieces (chunks) as the AI writes it
+# We print each piece of text as soon as it arrives, and glue the pieces of any tool calls back together
+class StreamedMessage:
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.content = ""
+        self.tool_calls = []
+        # The token usage, which the api sends in the last chunk when we ask for it
+        self.usage = None
+        # When we made the request and when the first chunk arrived, the gap is what the user waits before seeing anything
+        self.started_at = time.perf_counter()
+        self.first_chunk_at = None
+
+    def add(self, chunk):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        self.usage = getattr(chunk, "usage", None) or self.usage
+        # Some chunks (like the usage at the very end) carry no choices
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if self.echo:
+                # The role is printed before the first piece, just like pretty_print_message would
+                print_stream_chunk(delta.content, first=not self.content)
+            self.content += delta.content
+        # Each tool call arrives in pieces too, the index says which tool call a piece belongs to
+        # The id and name come in the first piece, the arguments are split over many pieces
+        for tool_call_delta in delta.tool_calls or []:
+            while len(self.tool_calls) <= tool_call_delta.index:
+                self.tool_calls.append(SimpleNamespace(
+                    id=None, type="function", function=SimpleNamespace(name="", arguments="")))
+            tool_call = self.tool_calls[tool_call_delta.index]
+            if tool_call_delta.id:
+                tool_call.id = tool_call_delta.id
+            if tool_call_delta.function:
+                tool_call.function.name += tool_call_delta.function.name or ""
+                tool_call.function.arguments += tool_call_delta.function.arguments or ""
+
+    # Return something that looks like completion.choices[0].message, so the rest of the code does not care
+    def message(self):
+        # Finish the line we were printing on
+        if self.echo and self.content:
+            print_stream_end(self.content)
+        return SimpleNamespace(role="assistant", content=self.content or None, tool_calls=self.tool_calls or None)
+
+
+    # Record the token usage and the time to the first chunk on the span for this api call
+    def record(self, current):
+        record_usage(current, self.usage)
+        if self.first_chunk_at is not None:
+            current.set(time_to_first_chunk_ms=round((self.first_chunk_at - self.started_at) * 1000, 3))
+
+
+# How many tokens we leave room for in a reply when we don't know yet how long it will be
+REPLY_TOKEN_ESTIMATE = 256
+
+
+# Roughly how many tokens a call will use, so it can be checked against the tokens per minute before we make it
+# About 4 characters of a message's json make a token, the real count is settled with the limiter once the api tells us
+def estimate_tokens(kwargs):
+    prompt = sum(len(encode(message)) for message in kwargs.get("messages", ())) // 4
+    return prompt + kwargs.get("max_tokens", REPLY_TOKEN_ESTIMATE)
+
+
+# The json of the last tools list we sent, the tools are made once and sent with every call
+_encoded_tools = (None, None)
+
+
+# The body of a chat completion request, as json
+# The messages already have theirs, so only the model, the tools and the other settings are encoded here
+def request_body(kwargs):
+    global _encoded_tools
+    fields = {key: value for key, value in kwargs.items() if key not in ("messages", "tools")}
+    parts = [dumps(fields)[1:-1], '"messages":' + encode_messages(kwargs["messages"])]
+    tools = kwargs.get("tools")
+    if tools:
+        if _encoded_tools[0] is not tools:
+            _encoded_tools = (tools, dumps(tools))
+        parts.append('"tools":' + _encoded_tools[1])
+    return "{" + ",".join(part for part in parts if part) + "}"
+
+
+# The same request for chat.completions.create(), which wants the messages as dictionaries
+# Older versions of create() don't take stream_options, so it goes in extra_body, which is sent as it is
+def create_arguments(kwargs):
+    arguments = {**kwargs, "messages": [message.to_dict() if isinstance(message, Message) else message
+                                        for message in kwargs["messages"]]}
+    if "stream_options" in arguments:
+        arguments["extra_body"] = {"stream_options": arguments.pop("stream_options")}
+    return arguments
+
+
+# Ask for a chat completion, returns the completion or, with stream=True, the chunks as they arrive
+# The client's own chat.completions.create() checks and copies every message again on every call,
+# which for a long conversation takes longer than encoding it, so we send the body we made with client.post instead
+# client.post is how the openai library sends a request as it is, the retries and errors are the same as create()'s
+# With an openai version we have not checked this against (see clients.py) we use create() after all
+def create_completion(**kwargs):
+    if not encoded_requests():
+        return get_openai_client().chat.completions.create(**create_arguments(kwargs))
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+    return get_openai_client().post("/chat/completions", body=EncodedJSON(request_body(kwargs)),
+                                    cast_to=ChatCompletion, stream=kwargs.get("stream", False),
+                                    stream_cls=openai.Stream[ChatCompletionChunk])
+
+
+# The async version of create_completion
+async def create_completion_async(**kwargs):
+    if not encoded_requests():
+        return await get_async_openai_client().chat.completions.create(**create_arguments(kwargs))
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+    return await get_async_openai_client().post("/chat/completions", body=EncodedJSON(request_body(kwargs)),
+                                                cast_to=ChatCompletion, stream=kwargs.get("stream", False),
+                                                stream_cls=openai.AsyncStream[ChatCompletionChunk])
+
+
+# The total tokens in a usage, which is completion.usage or the plain dict a streamed reply sends
+def used_tokens(usage):
+    if usage is None:
+        return None
+    return usage.get("total_tokens") if isinstance(usage, dict) else usage.total_tokens
+
+
+# Ask the api to send the token usage at the end of a streamed reply
+STREAM_USAGE = {"stream_options": {"include_usage": True}}
+
+
+# Make a streamed api call, printing the reply as it comes in
+def stream_completion(echo=True, **kwargs):
+    with span("llm.completion", model=kwargs.get("model"), stream=True) as current:
+        streamed = StreamedMessage(echo)
+        estimated = estimate_tokens(kwargs)
+        with openai_limits.call_sync(estimated):
+            for chunk in create_completion(stream=True, **STREAM_USAGE, **kwargs):
+                streamed.add(chunk)
+        openai_limits.settle(estimated, used_tokens(streamed.usage))
+        streamed.record(current)
+        return streamed.message()
+
+
+# The async version of stream_completion
+async def stream_completion_async(echo=True, **kwargs):
+    # The slot is held until the whole reply has arrived, since the request is still open until then
+    with span("llm.completion", model=kwargs.get("model"), stream=True) as current:
+        streamed = StreamedMessage(echo)
+        estimated = estimate_tokens(kwargs)
+        async with openai_limits.call(estimated):
+            async for chunk in await create_completion_async(stream=True, **STREAM_USAGE, **kwargs):
+                streamed.add(chunk)
+        openai_limits.settle(estimated, used_tokens(streamed.usage))
+        streamed.record(current)
+        return streamed.message()
+
+
+# Make an async api call and return the message, streamed or not depending on stream_responses
+async def complete_async(**kwargs):
+    if stream_responses:
+        return await stream_completion_async(**kwargs)
+    with span("llm.completion", model=kwargs.get("model"), stream=False) as current:
+        estimated = estimate_tokens(kwargs)
+        async with openai_limits.call(estimated):
+            completion = await create_completion_async(**kwargs)
+        openai_limits.settle(estimated, used_tokens(completion.usage))
+        record_usage(current, completion.usage)
+        return completion.choices[0].message
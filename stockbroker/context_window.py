@@ -0,0 +1,104 @@
+# standard python library
+import os
+from collections import deque
+
+from .messages import as_message
+
+# tiktoken is optional, it counts tokens exactly the way OpenAI does
+# pip install tiktoken
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Count the tokens in a piece of text
+# Without tiktoken we guess, roughly 4 characters of English make one token
+def make_token_counter(model):
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text))
+    return lambda text: len(text) // 4 + 1
+
+
+# Keeps the messages we send to the api under a token budget
+# The system prompt is always kept, and when the conversation gets too long the oldest turns are dropped
+# Each message is counted once when it is added, and we keep a running total,
+# so adding a message costs the same no matter how long the conversation is
+# on_append, if given, is called with every new message, e.g. to save it to a session store
+# Messages are kept as Message objects (see messages.py), plain dictionaries are turned into one when they are added
+class ContextWindow:
+    def __init__(self, system_prompt, budget=None, model="gpt-3.5-turbo", on_append=None):
+        self.budget = budget if budget is not None else int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+        self.count_tokens = make_token_counter(model)
+        self.system_prompt = as_message(system_prompt)
+        self.system_tokens = self.message_tokens(self.system_prompt)
+        # The messages oldest first, and what each one costs in tokens
+        # Two deques instead of one of (message, tokens) pairs, so there is no pair to keep around for every message
+        self.turns = deque()
+        self.turn_tokens = deque()
+        self.total_tokens = self.system_tokens
+        self.on_append = on_append
+
+    # The tokens one message costs
+    # Every message has a few tokens of overhead on top of its text, 4 is what OpenAI's own examples use
+    def message_tokens(self, message):
+        # Decode the message once, instead of once for every field we read
+        fields = message.to_dict()
+        tokens = 4 + self.count_tokens(fields.get("content") or "")
+        if fields.get("name"):
+            tokens += self.count_tokens(fields["name"])
+        return tokens
+
+    def append(self, message):
+        message = as_message(message)
+        self.add(message)
+        if self.on_append is not None:
+            self.on_append(message)
+        self.trim()
+
+    # Put back messages from an earlier run of this conversation, without calling on_append for them again
+    # Anything before the first user message is skipped, so we never start partway through a turn
+    def load(self, messages):
+        started = False
+        for message in messages:
+            message = as_message(message)
+            started = started or message.role == "user"
+            if started:
+                self.add(message)
+        self.trim()
+
+    # Add a message and count its tokens, append and load both use it
+    def add(self, message):
+        tokens = self.message_tokens(message)
+        self.turns.append(message)
+        self.turn_tokens.append(tokens)
+        self.total_tokens += tokens
+
+    # Drop the oldest turns until we fit in the budget
+    # We always drop a whole turn, everything from one user message up to the next one,
+    # so the AI never sees a function result without the question that asked for it
+    # The newest turn is never dropped, even if it is over the budget on its own
+    def trim(self):
+        while self.total_tokens > self.budget:
+            # Find where the second user message is, everything before it is the oldest turn
+            next_turn = None
+            for index, message in enumerate(self.turns):
+                if index > 0 and message.role == "user":
+                    next_turn = index
+                    break
+            if next_turn is None:
+                return
+            for _ in range(next_turn):
+                self.turns.popleft()
+                self.total_tokens -= self.turn_tokens.popleft()
+
+    # The messages to send to the api, system prompt first
+    def messages(self):
+        return [self.system_prompt, *self.turns]
+
+    def __len__(self):
+        return 1 + len(self.turns)
@@ -0,0 +1,320 @@
+# Conversations with the AI: the plain chat from the first weeks, and the sessions with function calling
+# standard python library, lets one program handle many conversations at the same time
+import asyncio
+import os
+import time
+from collections import OrderedDict
+# standard python library, a quick way to make simple objects
+from types import SimpleNamespace
+
+from . import completions
+from .completions import stream_completion, create_completion, complete_async, estimate_tokens, used_tokens
+# Keeps each conversation under a token budget, see context_window.py
+from .context_window import ContextWindow
+# Every message in a session is a Message, which keeps its own json, see messages.py
+from .messages import Message
+from .display import pretty_print_message, flush_output
+from .http_client import close_async_client
+from .portfolio import Portfolio
+# Remembers the answers to general questions, so the next person asking gets them at once, see response_cache.py
+from .response_cache import open_response_cache
+# Decides which model answers a turn, or answers price lookups without one, see router.py
+from . import router
+# Saves every message as it is made, so conversations survive a restart, see session_store.py
+from .session_store import open_session_store
+from .tools import (tool_registry, tools, run_tool_calls_async, function_messages, tool_failed, price_feed,
+                    current_session)
+from .tracing import span, record_usage, metrics
+# Paces our calls to the apis, and turns away calls that could not finish in time, see rate_limit.py
+from .rate_limit import openai_limits, deadline, RateLimited
+
+
+def conversation():
+    # Create a system prompt
+    system_prompt = {'role': 'system', 'content': "You are a helpful assistant."}
+    # print out the system prompt
+    pretty_print_message(system_prompt)
+    # Store our messages, starting with the system prompt
+    # The context window keeps what we send under a token budget by dropping the oldest turns, see context_window.py
+    message_list = ContextWindow(system_prompt)
+    # Loop infinitely
+    while True:
+        # Get user input, once everything printed so far is on the screen
+        flush_output()
+        user_input = input("You: ")
+        # Format the user input into a dictionary for the api
+        user_prompt = {'role': 'user', 'content': user_input}
+        # Add the user input to the message list
+        message_list.append(user_prompt)
+        # If somebody already asked this, reuse the answer the AI gave them instead of asking again
+        # Except for price questions: the AI can not look prices up here, and a saved price would only get more out of date
+        use_cache = response_cache is not None and router.price_lookup(user_input) is None
+        cache_scope = ("gpt-3.5-turbo", system_prompt['content'])
+        cached = response_cache.get(cache_scope, user_input) if use_cache else None
+        if cached is not None:
+            message = {'role': 'assistant', 'content': cached}
+            pretty_print_message(message)
+        # Make the api call
+        elif completions.stream_responses:
+            # The reply is printed piece by piece while it comes in
+            message = {'role': 'assistant', 'content': stream_completion(
+                model="gpt-3.5-turbo",
+                messages=message_list.messages(),
+            ).content}
+        else:
+            with span("llm.completion", model="gpt-3.5-turbo", stream=False) as current:
+                # Wait for our turn under the AI's rate limit, with a guess of how many tokens this uses
+                estimated = estimate_tokens({"messages": message_list.messages()})
+                with openai_limits.call_sync(estimated):
+                    completion = create_completion(
+                        model="gpt-3.5-turbo",
+                        messages=message_list.messages(),
+                    )
+                openai_limits.settle(estimated, used_tokens(completion.usage))
+                record_usage(current, completion.usage)
+            # Add the AI's response to the message list, and then loop again
+            message = {'role': 'assistant', 'content': completion.choices[0].message.content}
+            # print out the AI's response
+            pretty_print_message(message)
+        if cached is None and use_cache:
+            response_cache.set(cache_scope, user_input, message['content'])
+        # Add the AI's response to the message list
+        message_list.append(message)
+
+
+# Tools registered with user_ready=True give back a sentence we can show the user as is, e.g. "The price of bitcoin is $X"
+# When direct_tool_replies is on and a turn only called these, we reply with their output
+# instead of making a second api call just so the AI can say the same thing
+direct_tool_replies = os.environ.get("DIRECT_TOOL_REPLIES", "false").lower() in ("1", "true", "yes")
+# Keep the tools on the follow up api call, so the AI can use a second function after seeing the first one's results
+# (e.g. look up a price, then look up another) without waiting for the user to say something
+chain_tool_calls = os.environ.get("CHAIN_TOOL_CALLS", "false").lower() in ("1", "true", "yes")
+# The most rounds of function calls one turn can make, so a confused AI can not loop forever
+max_tool_rounds = int(os.environ.get("MAX_TOOL_ROUNDS", 3))
+# How many seconds a turn has to finish, a call to an api that would have to wait past this is turned away
+turn_deadline = float(os.environ.get("TURN_DEADLINE", 30))
+# The answers the AI gave to general questions, or None if RESPONSE_CACHE=false in the .env file
+response_cache = open_response_cache()
+
+
+# The system prompt every session starts with, they all share this one message
+system_prompt = Message('system', "You are a helpful assistant. If asked to, you can get the current price of bitcoin. You can also get the price of any cryptocurrency given its name and code, the prices of several cryptocurrencies at once, how a cryptocurrency's price changed over a recent period, technical indicators like moving averages, RSI, MACD, Bollinger bands and volatility, or the value of the user's portfolio. Always use the functions for these numbers instead of guessing them. The functions answer in json, prices are in US dollars and times are unix timestamps.")
+
+# Every conversation we are having, keyed by session id, the one used longest ago first
+# Each session has its own message list, and a lock so two turns of the same session can not run at once
+sessions = OrderedDict()
+# The most sessions we keep in memory, and how many seconds one can go unused before we forget it
+# A forgotten session's messages are still in the session store, so if it comes back it picks up where it left off
+max_sessions = int(os.environ.get("MAX_SESSIONS", 10000))
+session_idle = float(os.environ.get("SESSION_IDLE", 3600))
+# Where every message gets saved
+session_store = open_session_store()
+# How many saved messages we load back when a session we don't have in memory comes back
+resume_messages = int(os.environ.get("SESSION_RESUME_MESSAGES", 50))
+
+
+class Session:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        # Every message added to the list is also saved to the store, one at a time
+        self.message_list = ContextWindow(system_prompt,
+                                          on_append=lambda message: session_store.append(session_id, message))
+        # Whether the saved messages have been read back yet, see load()
+        self.loaded = False
+        self.lock = asyncio.Lock()
+        # The holdings this session told value_portfolio about, saved with the session every time they change
+        self.portfolio = Portfolio(on_change=lambda holdings: session_store.save_holdings(session_id, holdings))
+        self.last_used = time.monotonic()
+
+    # Pick up where this session left off: its most recent messages and its portfolio holdings are read back
+    # Reading the store can wait on the disk, so it runs in a thread instead of holding up every other session's turn
+    async def load(self):
+        messages, holdings = await asyncio.to_thread(self.read_saved)
+        self.message_list.load(messages)
+        if holdings:
+            self.portfolio.restore(holdings)
+        self.loaded = True
+
+    def read_saved(self):
+        return (session_store.load_recent(self.session_id, resume_messages),
+                session_store.load_holdings(self.session_id))
+
+
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        session = sessions[session_id] = Session(session_id)
+    else:
+        sessions.move_to_end(session_id)
+    session.last_used = time.monotonic()
+    evict_sessions()
+    return session
+
+
+# Forget the sessions that went unused for session_idle seconds, and the ones used longest ago past max_sessions
+# sessions is in the order they were last used, so we only ever look at the oldest ones
+# A session with a turn running is kept, and so is everything used after it, until the turn is over
+def evict_sessions():
+    cutoff = time.monotonic() - session_idle
+    while sessions:
+        session_id, session = next(iter(sessions.items()))
+        if len(sessions) <= max_sessions and session.last_used >= cutoff:
+            break
+        if session.lock.locked():
+            break
+        del sessions[session_id]
+        if price_feed is not None:
+            price_feed.unsubscribe(session_id)
+        metrics.inc("stockbroker_sessions_evicted_total")
+
+
+# Handle one turn of one conversation: the user says something, and we return what the AI says back
+# This is the same thing the loop in conversation_with_functions used to do, but it does not wait on input()
+# and every api call is awaited, so one event loop can run turns for as many sessions as we want at once
+async def handle_turn(session_id, user_text):
+    session = get_session(session_id)
+    async with session.lock:
+        # A session's first turn reads its saved messages back, the lock keeps its other turns waiting until it has
+        if not session.loaded:
+            await session.load()
+        # Everything this turn does is timed under one span, so it can be traced as a whole
+        with span("turn", session_id=session_id) as turn:
+            current_session.set(session)
+            deadline.set(time.monotonic() + turn_deadline)
+            message_list = session.message_list
+            message_list.append(Message('user', user_text))
+            # A question that only asks for prices is answered straight from the price functions, with no api call
+            # If they fail, the AI gets the turn so it can explain what went wrong
+            route = router.classify(user_text)
+            # A price question is never answered from the response cache, even when the price functions failed
+            # or MODEL_ROUTER=false sends it to the AI like any other question
+            use_cache = response_cache is not None and router.price_lookup(user_text) is None
+            if route.kind == "price":
+                reply = await router.answer_price_lookup(route)
+                if reply is not None:
+                    return finish_turn(turn, message_list, route, reply)
+                route = router.Route("simple", router.cheap_model)
+            # If somebody already asked this, or is asking it right now, their answer is reused
+            # The model and the system prompt are what shape an answer besides the question itself
+            # The system prompt's json stands in for its text, it is already made and its hash is only worked out once
+            cache_scope = (route.model, system_prompt.json)
+            if use_cache:
+                cached = await response_cache.get_async(cache_scope, user_text)
+                metrics.inc("stockbroker_response_cache_total", result="miss" if cached is None else "hit")
+                if cached is not None:
+                    turn.set(cached=True)
+                    return finish_turn(turn, message_list, route, cached)
+            answer = None
+            try:
+                message, route, from_model, called_tools = await ask_model(message_list, route)
+                # Answers are only reused when the AI called no functions, since those look up prices and the portfolio
+                if not called_tools:
+                    answer = message.content
+            finally:
+                if use_cache:
+                    response_cache.finish(cache_scope, user_text, answer)
+            # A streamed reply has already been printed while it came in
+            return finish_turn(turn, message_list, route, message.content,
+                               printed=completions.stream_responses and from_model)
+
+
+# Ask the AI to answer the conversation, running any functions it calls
+# Returns the final message, the route (which changes if the turn was escalated), whether the AI wrote the message
+# and whether it called any functions
+async def ask_model(message_list, route):
+    # Make the api call, just like normal
+    # When streaming, a normal answer is printed as it is written, and tool calls are collected quietly
+    message = await complete_async(
+        model=route.model,
+        messages=message_list.messages(),
+        # Pass in the tools we have available
+        tools=tools,
+    )
+    # Whether the reply we end up with was written by the AI, and so already printed if we streamed it
+    from_model = True
+    called_tools = False
+    # If the message has a function call, we need to execute it
+    # With chain_tool_calls the AI can ask for more functions after seeing the results, up to max_tool_rounds times
+    for tool_round in range(max_tool_rounds):
+        if not message.tool_calls:
+            break
+        called_tools = True
+        # Execute every function call stored in the message
+        # The results stay as objects here, and only the AI gets them as json
+        results = await run_tool_calls_async(message)
+        responses = function_messages(message.tool_calls, results)
+        for response in responses:
+            pretty_print_message(response)
+            message_list.append(response)
+        # The cheap model can call the analysis functions, but the bigger model explains what they found
+        names = [tool_call.function.name for tool_call in message.tool_calls]
+        if route.kind != "analysis" and any(tool_registry.is_analysis(name) for name in names):
+            route = router.escalate(route)
+        # If every function's result can be said to the user as it is, skip asking the AI to repeat it
+        if direct_tool_replies and all(
+                tool_registry.is_user_ready(name) and not tool_failed(result) for name, result in zip(names, results)):
+            message = SimpleNamespace(content="\n".join(str(result) for result in results))
+            from_model = False
+            break
+        # We want the AI to say the message, so we have to make one more completion for all of them
+        # On the last round we leave the tools off, so the AI has to answer with words
+        follow_up = {"tools": tools} if chain_tool_calls and tool_round < max_tool_rounds - 1 else {}
+        message = await complete_async(
+            model=route.model,
+            messages=message_list.messages(),
+            **follow_up,
+        )
+    return message, route, from_model, called_tools
+
+
+# Print the reply (unless it already was), add it to the conversation and record where the turn went
+def finish_turn(turn, message_list, route, content, printed=False):
+    turn.set(route=route.kind)
+    metrics.inc("stockbroker_turns_total", route=route.kind)
+    response = Message('assistant', content)
+    if not printed:
+        pretty_print_message(response)
+    message_list.append(response)
+    return content
+
+
+# Our modified conversation function with function calling
+# The terminal is now just one session talking to handle_turn
+def conversation_with_functions():
+    asyncio.run(terminal_session())
+
+
+async def terminal_session(session_id="terminal"):
+    # Print out the system prompt
+    pretty_print_message(system_prompt)
+    startup()
+    try:
+        # Loop infinitely
+        while True:
+            # Get user input, in a thread so the event loop is not blocked while we wait for the user to type
+            # Messages are printed in the background, so wait for them first or the prompt could come before the reply
+            flush_output()
+            user_input = await asyncio.to_thread(input, "You: ")
+            try:
+                await handle_turn(session_id, user_input)
+            except RateLimited as e:
+                # Too busy right now, say so and let the user try again instead of ending the conversation
+                pretty_print_message({'role': 'assistant', 'content': f"Sorry, {e}"})
+    finally:
+        await shutdown()
+
+
+# Start everything that runs in the background, call this from inside the event loop before the first turn
+def startup():
+    if price_feed is not None:
+        price_feed.start()
+
+
+# Stop everything running in the background, call this when the event loop is about to finish
+async def shutdown():
+    if price_feed is not None:
+        await price_feed.stop()
+    await close_async_client()
+    # Make sure every message is saved and printed before we exit
+    session_store.close()
+    flush_output()
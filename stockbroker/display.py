@@ -0,0 +1,276 @@
+# Printing messages to the terminal
+# Printing used to happen right where each message was made, so with many sessions at once every turn waited on the console
+# Now a sink turns each message into text, and a writer thread does the actual writing in the background:
+# printing a message only puts a line on a queue, and the writer writes everything waiting in one go
+# The sink is picked with DISPLAY_SINK in the .env file:
+#   tty    (the default) like before, with colors if the terminal can show them
+#   plain  the same text without colors, e.g. for a log file
+#   jsonl  one json object per message, for tools that read the output
+#   null   print nothing at all, for running headless under load
+# standard python library
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+# pip install termcolor
+from termcolor import colored
+
+from .messages import Message, encode, dumps
+from .tracing import metrics
+
+
+# Pretty print the message based on the role
+# This is useful when we are dealing with function calling, as it can get
+# complicated to understand what state the code is in
+# Dictionary to map the role to a color
+role_to_color = {
+    "system": "red",
+    "user": "green",
+    "assistant": "blue",
+    "function": "magenta",
+    "error": "red",
+}
+
+
+# Whether a stream can show colors, instead of always sending them
+# NO_COLOR and FORCE_COLOR are the usual ways to say so, otherwise only a real terminal gets colors
+def supports_color(stream):
+    if os.environ.get("NO_COLOR"):
+        return False
+    if os.environ.get("FORCE_COLOR"):
+        return True
+    if os.environ.get("TERM") == "dumb":
+        return False
+    isatty = getattr(stream, "isatty", None)
+    return bool(isatty and isatty())
+
+
+# Prints messages as "role: content", like the tutorials always have, with colors if color is True
+class TextSink:
+    def __init__(self, color=False):
+        self.color = color
+
+    def paint(self, text, role):
+        if self.color and role in role_to_color:
+            return colored(text, role_to_color[role], force_color=True)
+        return text
+
+    def format(self, message):
+        # A Message keeps its fields as json, so decode it once here instead of once for every field we read
+        if isinstance(message, Message):
+            message = message.to_dict()
+        role = message["role"]
+        # AI message when calling a function
+        if role == "assistant" and message.get("function_call"):
+            text = f"assistant: {message['function_call']}"
+        # Function message
+        elif role == "function":
+            text = f"function ({message['name']}): {message['content']}"
+        # System prompt, user message and normal AI message
+        else:
+            text = f"{role}: {message['content']}"
+        return self.paint(text, role) + "\n"
+
+    # A piece of a streamed reply, the role is printed before the first one
+    def format_chunk(self, text, first):
+        return (self.paint("assistant: ", "assistant") if first else "") + self.paint(text, "assistant")
+
+    # The streamed reply is over, finish its line
+    def format_stream_end(self, content):
+        return "\n"
+
+    # Something went wrong in the background, e.g. an api call that failed
+    def format_error(self, text):
+        return self.paint(f"Error: {text}", "error") + "\n"
+
+
+# One json object per line: when it was printed and the message itself
+# A Message already has its json, so this costs next to nothing
+class JSONLinesSink:
+    def format(self, message):
+        return f'{{"time":{time.time():.3f},"message":{encode(message)}}}\n'
+
+    # Pieces of a streamed reply are not printed, the whole reply is once it is done
+    def format_chunk(self, text, first):
+        return None
+
+    def format_stream_end(self, content):
+        return self.format(Message("assistant", content))
+
+    def format_error(self, text):
+        return f'{{"time":{time.time():.3f},"error":{dumps(text)}}}\n'
+
+
+# Prints nothing
+class NullSink:
+    def format(self, message):
+        return None
+
+    def format_chunk(self, text, first):
+        return None
+
+    def format_stream_end(self, content):
+        return None
+
+    def format_error(self, text):
+        return None
+
+
+# Writes text to a stream from a background thread
+# write() only adds the text to a deque and wakes the thread up, so it never waits on the console
+# (appending to a deque needs no lock, so this costs about as much as the append itself)
+# The thread takes everything waiting and writes it in one go, so under load it writes in big batches,
+# and when things are quiet each line is still written straight away
+# If max_pending pieces are already waiting, new ones are dropped (and counted) instead of using up memory
+# stream None means whatever sys.stdout is at the time, so redirecting stdout still works
+class BufferedWriter:
+    def __init__(self, stream=None, max_pending=10000):
+        self.stream = stream
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            thread = threading.Thread(target=self._write_loop, name="display-writer", daemon=True)
+            thread.start()
+            # Write out what is still waiting when the program ends
+            atexit.register(self.close)
+            self._thread = thread
+
+    def write(self, text):
+        if self._thread is None:
+            self._start()
+        if len(self._pending) >= self.max_pending:
+            metrics.inc("stockbroker_display_dropped_total")
+            return
+        self._pending.append(text)
+        if not self._wake.is_set():
+            self._wake.set()
+
+    # Wait until everything written so far is out, e.g. before asking the user to type
+    # The thread sets the event once it has written everything before it
+    def flush(self, timeout=5.0):
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._pending.append(done)
+        self._wake.set()
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._pending.append(None)
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            texts = []
+            while self._pending:
+                item = self._pending.popleft()
+                if isinstance(item, str):
+                    texts.append(item)
+                    continue
+                # A flush or close is waiting on everything before it
+                self._write(texts)
+                texts = []
+                if item is None:
+                    return
+                item.set()
+            self._write(texts)
+
+    def _write(self, texts):
+        if not texts:
+            return
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("".join(texts))
+            stream.flush()
+        except (OSError, ValueError):
+            # The console went away (e.g. a closed pipe), there is nobody left to print to
+            pass
+
+
+# Turns messages into text with a sink and hands it to a writer
+class Renderer:
+    def __init__(self, sink, writer):
+        self.sink = sink
+        self.writer = writer
+
+    def message(self, message):
+        text = self.sink.format(message)
+        if text:
+            self.writer.write(text)
+
+    def chunk(self, text, first):
+        text = self.sink.format_chunk(text, first)
+        if text:
+            self.writer.write(text)
+
+    def stream_end(self, content):
+        text = self.sink.format_stream_end(content)
+        if text:
+            self.writer.write(text)
+
+    def error(self, text):
+        text = self.sink.format_error(text)
+        if text:
+            self.writer.write(text)
+
+
+# Make the renderer the .env file asks for
+# DISPLAY_SINK picks the sink (not DISPLAY, which X11 already uses)
+# DISPLAY_MAX_PENDING is how many pieces of text can wait to be written before we start dropping them
+def open_renderer():
+    kind = os.environ.get("DISPLAY_SINK", "tty").lower()
+    if kind == "tty":
+        sink = TextSink(color=supports_color(sys.stdout))
+    elif kind == "plain":
+        sink = TextSink()
+    elif kind == "jsonl":
+        sink = JSONLinesSink()
+    elif kind == "null":
+        sink = NullSink()
+    else:
+        raise ValueError(f"Unknown DISPLAY_SINK {kind!r}, use tty, plain, jsonl or null")
+    return Renderer(sink, BufferedWriter(max_pending=int(os.environ.get("DISPLAY_MAX_PENDING", 10000))))
+
+
+renderer = open_renderer()
+
+
+def pretty_print_message(message):
+    renderer.message(message)
+
+
+# Print a piece of a streamed reply, first is True for the first piece
+def print_stream_chunk(text, first):
+    renderer.chunk(text, first)
+
+
+# A streamed reply is finished, content is the whole reply
+def print_stream_end(content):
+    renderer.stream_end(content)
+
+
+# Print an error, e.g. an api call that failed, without holding up the code that ran into it
+def print_error(text):
+    renderer.error(text)
+
+
+# Wait until everything printed so far is on the screen
+def flush_output():
+    renderer.writer.flush()
@@ -0,0 +1,185 @@
+# standard python library
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlparse
+# Timing spans, see tracing.py
+from .tracing import span, metrics
+# Keeps us under the price api's rate limit, see rate_limit.py
+from .rate_limit import cryptocompare_limits, RateLimited
+# Both http libraries are only imported when the first request is made, see lazy.py
+from .lazy import lazy_import
+# installed with openai, we use it for the async version of the client
+httpx = lazy_import("httpx")
+# pip install requests
+requests = lazy_import("requests")
+
+
+# Settings for the shared http client
+# Every value can be changed from the .env file without touching the code
+# pool_size: how many open connections we keep around per host
+# connect_timeout / read_timeout: how many seconds we wait before giving up on the api
+# max_retries: how many times we retry a request that failed with 429 or a 5xx error
+# backoff: the base wait between retries, it doubles every retry (backoff, 2*backoff, 4*backoff, ...)
+class HttpConfig:
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None, backoff=None):
+        self.pool_size = pool_size if pool_size is not None else int(os.environ.get("HTTP_POOL_SIZE", 10))
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.environ.get("HTTP_READ_TIMEOUT", 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("HTTP_MAX_RETRIES", 3))
+        self.backoff = backoff if backoff is not None else float(os.environ.get("HTTP_BACKOFF", 0.5))
+
+    @property
+    def timeout(self):
+        # requests takes the two timeouts as a tuple
+        return (self.connect_timeout, self.read_timeout)
+
+
+# Rate limited or a server error, worth trying again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Build a requests Session that keeps connections open between calls
+# Reusing a connection skips the TCP and TLS handshake, which is most of the time a small api call takes
+def create_session(config):
+    # urllib3 is installed with requests, it retries requests that could not connect for us
+    # Retrying on a status (like 429) is done in http_get instead, so the wait can respect the rate limits and the deadline
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(
+        total=config.max_retries,
+        backoff_factor=config.backoff,
+        status_forcelist=(),
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(pool_connections=config.pool_size, pool_maxsize=config.pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# The one session every price function shares
+# It is made the first time we need it, and can be swapped out with configure()
+_config = None
+_session = None
+_lock = threading.Lock()
+
+
+def configure(config=None):
+    global _config, _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _config = config or HttpConfig()
+        _session = create_session(_config)
+
+
+def get_session():
+    global _config, _session
+    if _session is None:
+        with _lock:
+            # Check again, another thread may have made it while we waited for the lock
+            if _session is None:
+                _config = HttpConfig()
+                _session = create_session(_config)
+    return _session
+
+
+# Drop in replacement for requests.get that uses the shared session and always has a timeout
+# Failures still raise requests.exceptions.RequestException, so the old error handling keeps working
+# limits is the rate limit the request counts against, a request that can not go in time raises RateLimited
+# A request answered with a retry status is tried again, up to max_retries times, each try taking its own turn under limits
+def http_get(url, limits=cryptocompare_limits, **kwargs):
+    session = get_session()
+    kwargs.setdefault("timeout", _config.timeout)
+    with span("http.get", **url_attributes(url)) as current:
+        for attempt in range(_config.max_retries + 1):
+            with limits.call_sync():
+                response = session.get(url, **kwargs)
+            if response.status_code not in RETRY_STATUSES:
+                break
+            if attempt == _config.max_retries:
+                response.raise_for_status()
+            # Sleep outside limits.call_sync, so the wait does not hold one of the open request slots
+            time.sleep(retry_delay(response, attempt, limits))
+        current.set(status=response.status_code)
+        return response
+
+
+# How long to wait before trying again a request that was answered with a retry status
+# If the api tells us how long to wait we listen to it, otherwise the wait doubles every try (backoff, 2*backoff, ...)
+# A 429 pauses the limits, so everyone else calling this api waits too instead of getting a 429 of their own
+# Raises RateLimited instead if the wait would go past the turn's deadline, by then nobody is waiting for the answer
+def retry_delay(response, attempt, limits):
+    retry_after = response.headers.get("Retry-After")
+    delay = int(retry_after) if retry_after and retry_after.isdigit() else _config.backoff * (2 ** attempt)
+    if response.status_code == 429:
+        limits.pause(delay)
+    if delay >= limits.time_left():
+        metrics.inc("stockbroker_upstream_rejected_total", upstream=limits.name)
+        raise RateLimited(f"the {limits.name} api is busy, try again in about {delay} seconds", delay)
+    return delay
+
+
+# What we record about a request, the query string is left out so spans group nicely
+def url_attributes(url):
+    parts = urlparse(url)
+    return {"host": parts.netloc, "path": parts.path}
+
+
+# The async client, made with the same settings as the session above
+# It belongs to the event loop that made it, so it is made lazily from inside async code
+_async_client = None
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        if _config is None:
+            get_session()
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=_config.pool_size, max_keepalive_connections=_config.pool_size),
+            timeout=httpx.Timeout(_config.read_timeout, connect=_config.connect_timeout),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+# Async version of http_get
+# httpx does not retry by itself, so requests that could not connect are retried here too, with the same backoff
+# Failures raise httpx.HTTPError
+async def async_http_get(url, limits=cryptocompare_limits, **kwargs):
+    with span("http.get", **url_attributes(url)) as current:
+        response = await _async_http_get(url, limits, **kwargs)
+        current.set(status=response.status_code)
+        return response
+
+
+async def _async_http_get(url, limits, **kwargs):
+    client = get_async_client()
+    for attempt in range(_config.max_retries + 1):
+        last_attempt = attempt == _config.max_retries
+        try:
+            async with limits.call():
+                response = await client.get(url, **kwargs)
+        except httpx.TransportError:
+            delay = _config.backoff * (2 ** attempt)
+            # No point waiting to try again if the answer would come after the deadline
+            if last_attempt or delay >= limits.time_left():
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            if last_attempt:
+                response.raise_for_status()
+            delay = retry_delay(response, attempt, limits)
+        # The wait is outside limits.call, so it does not hold one of the open request slots
+        await asyncio.sleep(delay)
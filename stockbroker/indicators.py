@@ -0,0 +1,172 @@
+# Technical indicators (moving averages, RSI, MACD, Bollinger bands, volatility) worked out with numpy
+# Every function takes a whole array of prices and does the work for all of them at once, instead of a python loop per price,
+# so thousands of candles take well under a millisecond
+# IndicatorEngine remembers where each indicator got to, so when new candles arrive it only works through the new ones
+# standard python library
+import math
+# pip install numpy, only imported the first time it is used, see lazy.py
+from .lazy import lazy_import
+np = lazy_import("numpy")
+
+# Seconds in a year, for turning the volatility of one candle into a yearly volatility
+SECONDS_PER_YEAR = 365 * 86400
+# An exponential average is worked out in blocks, the weights inside one block can grow this big before we start a new one
+BLOCK_RANGE = 1e50
+
+
+# Exponential moving average, each value counts alpha and everything before it counts (1 - alpha)
+# alpha is 2 / (period + 1) for a normal EMA, and 1 / period for Wilder's smoothing (what RSI uses)
+# initial is the average just before the first value, leave it out to start at the first value
+# Each result depends on the one before it, which looks like it needs a loop, but inside a block it is
+#   ema[k] = decay^(k+1) * (initial + alpha * sum(values[i] / decay^(i+1) for i <= k))
+# which is a cumsum, the blocks keep decay^-(i+1) from getting too big for a float
+def ema(values, alpha, initial=None):
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty(len(values))
+    if not len(values):
+        return result
+    decay = 1.0 - alpha
+    if decay <= 0:
+        result[:] = values
+        return result
+    block = max(1, int(math.log(BLOCK_RANGE) / -math.log(decay)))
+    powers = decay ** np.arange(1, min(block, len(values)) + 1)
+    previous = values[0] if initial is None else initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        scale = powers[:len(chunk)]
+        result[start:start + len(chunk)] = scale * (previous + alpha * np.cumsum(chunk / scale))
+        previous = result[start + len(chunk) - 1]
+    return result
+
+
+# Simple moving average over the last `period` values, nan until there are enough values
+def sma(values, period):
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) >= period:
+        sums = np.cumsum(np.concatenate(([0.0], values)))
+        result[period - 1:] = (sums[period:] - sums[:-period]) / period
+    return result
+
+
+# Middle, upper and lower Bollinger band: the moving average, plus and minus `width` standard deviations
+def bollinger(values, period=20, width=2.0):
+    values = np.asarray(values, dtype=np.float64)
+    middle = sma(values, period)
+    # Standard deviation from the moving averages of the values and of their squares
+    variance = np.maximum(sma(values * values, period) - middle * middle, 0.0)
+    spread = width * np.sqrt(variance)
+    return middle, middle + spread, middle - spread
+
+
+# Relative strength index (0 to 100), using Wilder's smoothing of the gains and losses
+# gain and loss are the smoothed averages just before the first price change, to carry on from an earlier run
+# Returns the rsi plus the smoothed gains and losses, so the caller can keep them
+def rsi(values, period=14, gain=None, loss=None):
+    changes = np.diff(np.asarray(values, dtype=np.float64))
+    gains = np.maximum(changes, 0.0)
+    losses = np.maximum(-changes, 0.0)
+    if gain is None:
+        # Start from the plain average of the first `period` changes, like Wilder did
+        if len(changes) < period:
+            empty = np.full(len(changes), np.nan)
+            return empty, empty, empty
+        gain, loss = gains[:period].mean(), losses[:period].mean()
+        gains, losses = gains[period:], losses[period:]
+        head = np.full(period, np.nan)
+        head[-1] = 100.0 - 100.0 / (1.0 + gain / loss) if loss else 100.0
+    else:
+        head = np.empty(0)
+    average_gains = ema(gains, 1.0 / period, gain)
+    average_losses = ema(losses, 1.0 / period, loss)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values_rsi = np.where(average_losses > 0, 100.0 - 100.0 / (1.0 + average_gains / average_losses), 100.0)
+    return np.concatenate((head, values_rsi)), average_gains, average_losses
+
+
+# MACD line (fast EMA minus slow EMA), its signal line (an EMA of the MACD line), and the histogram between them
+# state is (fast, slow, signal) from the end of an earlier run, to carry on from it
+def macd(values, fast=12, slow=26, signal=9, state=None):
+    fast_state, slow_state, signal_state = state if state is not None else (None, None, None)
+    fast_ema = ema(values, 2.0 / (fast + 1), fast_state)
+    slow_ema = ema(values, 2.0 / (slow + 1), slow_state)
+    line = fast_ema - slow_ema
+    signal_line = ema(line, 2.0 / (signal + 1), signal_state)
+    return line, signal_line, line - signal_line, fast_ema, slow_ema
+
+
+# Yearly volatility from the last `period` candles: the standard deviation of the log returns, scaled up to a year
+def realized_volatility(values, period, step):
+    values = np.asarray(values, dtype=np.float64)[-(period + 1):]
+    if len(values) < 3 or np.any(values <= 0):
+        return float("nan")
+    returns = np.diff(np.log(values))
+    return float(np.std(returns, ddof=1) * math.sqrt(SECONDS_PER_YEAR / step))
+
+
+# Works out the latest value of an indicator for a coin, remembering where it got to
+# The exponential ones (EMA, RSI, MACD) carry their averages over, so only candles newer than the last run are looked at
+# The windowed ones (SMA, Bollinger, volatility) only ever look at the last `period` candles anyway
+class IndicatorEngine:
+    def __init__(self):
+        # (coin, interval, indicator, period) -> (time of the last candle used, the averages at that candle)
+        self.states = {}
+
+    # The candles after `last_time`, or None if last_time is not in this history (e.g. the history was replaced)
+    @staticmethod
+    def _new_since(times, last_time):
+        index = int(np.searchsorted(times, last_time))
+        if index >= len(times) or times[index] != last_time:
+            return None
+        return index + 1
+
+    # The latest values of `indicator` over the candles in times and closes, as a dict
+    def latest(self, key, indicator, times, closes, period, step):
+        if not len(closes):
+            return None
+        if indicator == "sma":
+            tail = closes[-period:]
+            return {"sma": float(np.mean(tail))} if len(tail) == period else None
+        if indicator == "bollinger":
+            middle, upper, lower = bollinger(closes[-period:], period)
+            return None if np.isnan(middle[-1]) else {"middle": float(middle[-1]), "upper": float(upper[-1]),
+                                                      "lower": float(lower[-1])}
+        if indicator == "volatility":
+            volatility = realized_volatility(closes, period, step)
+            return None if math.isnan(volatility) else {"volatility": volatility}
+
+        state_key = (key, indicator, period)
+        last_time, state = self.states.get(state_key, (None, None))
+        start = self._new_since(times, last_time) if last_time is not None else None
+        if start is None:
+            # Nothing to carry on from, work through the whole history
+            start, state = 0, None
+            if indicator == "rsi" and len(closes) <= period:
+                return None
+        if indicator == "ema":
+            values = ema(closes[start:], 2.0 / (period + 1), state)
+            value = state if not len(values) else float(values[-1])
+            self.states[state_key] = (times[-1], value)
+            return {"ema": value}
+        if indicator == "rsi":
+            # RSI works on price changes, so it needs the candle before the first new one too
+            gain, loss = state if state is not None else (None, None)
+            values, gains, losses = rsi(closes[max(start - 1, 0):], period, gain, loss)
+            if not len(gains):
+                if state is None:
+                    return None
+                values = [100.0 - 100.0 / (1.0 + gain / loss) if loss else 100.0]
+            else:
+                self.states[state_key] = (times[-1], (float(gains[-1]), float(losses[-1])))
+            return {"rsi": float(values[-1])}
+        if indicator == "macd":
+            line, signal_line, histogram, fast_ema, slow_ema = macd(closes[start:], state=state)
+            if not len(line):
+                fast_value, slow_value, signal_value = state
+                line, signal_line = [fast_value - slow_value], [signal_value]
+                histogram = [line[0] - signal_value]
+            else:
+                self.states[state_key] = (times[-1], (float(fast_ema[-1]), float(slow_ema[-1]), float(signal_line[-1])))
+            return {"macd": float(line[-1]), "signal": float(signal_line[-1]), "histogram": float(histogram[-1])}
+        raise ValueError(f"Unknown indicator {indicator!r}")
@@ -0,0 +1,41 @@
+# Helpers for putting off slow work until something actually needs it
+# Importing openai alone takes most of a second, so a worker or a test that only wants get_crypto_price
+# should not have to pay for it, or for making clients it never uses
+# standard python library, everything here is built in
+import functools
+import importlib.util
+import sys
+import threading
+
+
+# Import a module the first time one of its attributes is used, instead of right now
+# e.g. numpy = lazy_import("numpy") costs nothing until the first numpy.array(...)
+# This is the recipe from the importlib documentation
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# Decorator for a function without arguments that makes something once, e.g. a client
+# The first call makes it, every call after that gets the same one back, even from several threads at once
+def once(function):
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(function)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(function())
+        return result[0]
+    return wrapper
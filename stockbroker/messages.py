@@ -0,0 +1,81 @@
+# The messages in a conversation
+# A long conversation holds hundreds of messages, a busy server holds thousands of conversations,
+# and every call to the AI sends a conversation's messages all over again, so a message is made to be small and cheap to send:
+# - it is kept as the json we send to the api, made once when the message is made,
+#   so an api call only joins the messages' json together instead of encoding the whole conversation again
+# - it uses __slots__ instead of a dictionary, and its role is one shared (interned) string
+# The other fields are only decoded when something reads them, e.g. message["content"], which happens once or twice
+# A message can not be changed once it is made, make a new one instead
+# standard python library, everything here is built in
+import json
+import sys
+
+# Every message with the same role shares the one string, even the messages read back from the session store
+ROLES = {role: sys.intern(role) for role in ("system", "user", "assistant", "function", "tool")}
+
+
+def intern_role(role):
+    return ROLES.get(role) or sys.intern(role)
+
+
+# Json without the spaces after , and :, they are only more bytes to send
+def dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+# One message, e.g. Message("user", "What is the price of bitcoin?")
+# Any other fields the api takes, like name or tool_call_id, are passed by name, the ones that are None are left out
+class Message:
+    __slots__ = ("role", "json")
+
+    def __init__(self, role, content=None, **fields):
+        self.role = intern_role(role)
+        self.json = dumps({"role": role, "content": content,
+                           **{key: value for key, value in fields.items() if value is not None}})
+
+    # Make a message from json we already have, e.g. a row in the session store, without encoding it again
+    @classmethod
+    def from_json(cls, text):
+        message = cls.__new__(cls)
+        message.role = intern_role(json.loads(text)["role"])
+        message.json = text
+        return message
+
+    # Make a message from a dictionary, for code that still makes them
+    @classmethod
+    def from_dict(cls, fields):
+        message = cls.__new__(cls)
+        message.role = intern_role(fields["role"])
+        message.json = dumps(fields)
+        return message
+
+    def to_dict(self):
+        return json.loads(self.json)
+
+    # A message can be read like the dictionaries the code used to pass around, e.g. message["content"]
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        return self.to_dict()[key]
+
+    def get(self, key, default=None):
+        if key == "role":
+            return self.role
+        return self.to_dict().get(key, default)
+
+    def __repr__(self):
+        return f"Message({self.json})"
+
+
+def as_message(message):
+    return message if isinstance(message, Message) else Message.from_dict(message)
+
+
+# The json for one message, a Message already has it
+def encode(message):
+    return message.json if isinstance(message, Message) else dumps(message)
+
+
+# A list of messages as a json array, only the messages that are not a Message yet get encoded
+def encode_messages(messages):
+    return "[" + ",".join(encode(message) for message in messages) + "]"
@@ -0,0 +1,103 @@
+# A portfolio of cryptocurrency holdings, kept for one session
+# The holdings are numpy arrays, so working out the value, weights and profit of every coin is a few array operations,
+# and each coin remembers when it was last priced, so revaluing only asks for the prices that are out of date
+# standard python library
+import math
+import time
+# pip install numpy, only imported the first time it is used, see lazy.py
+from .lazy import lazy_import
+np = lazy_import("numpy")
+
+
+# on_change is called with holdings() whenever changed() is, e.g. to save them with the session
+class Portfolio:
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        # Coin code -> its row in the arrays below
+        self.index = {}
+        self.codes = []
+        self.amounts = np.empty(0)
+        # What was paid for one coin, nan if we were never told
+        self.cost_basis = np.empty(0)
+        self.prices = np.empty(0)
+        # When each price was fetched, 0 if it never was
+        self.priced_at = np.empty(0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Add or change holdings, an amount of 0 removes the coin
+    # A coin whose amount changed keeps its price, only coins we have never priced need a new one
+    def update(self, codes, amounts, cost_basis=None):
+        cost_basis = cost_basis if cost_basis is not None else [None] * len(codes)
+        new_codes = [code for code in dict.fromkeys(codes) if code not in self.index]
+        if new_codes:
+            self.index.update((code, len(self.codes) + offset) for offset, code in enumerate(new_codes))
+            self.codes.extend(new_codes)
+            grow = np.zeros(len(new_codes))
+            self.amounts = np.concatenate((self.amounts, grow))
+            self.cost_basis = np.concatenate((self.cost_basis, np.full(len(new_codes), np.nan)))
+            self.prices = np.concatenate((self.prices, np.full(len(new_codes), np.nan)))
+            self.priced_at = np.concatenate((self.priced_at, grow))
+        for code, amount, cost in zip(codes, amounts, cost_basis):
+            row = self.index[code]
+            self.amounts[row] = amount
+            if cost is not None:
+                self.cost_basis[row] = cost
+        if any(amount == 0 for amount in amounts):
+            self.remove(code for code, amount in zip(codes, amounts) if amount == 0)
+
+    def remove(self, codes):
+        drop = {self.index[code] for code in codes if code in self.index}
+        keep = np.array([row not in drop for row in range(len(self.codes))], dtype=bool)
+        self.codes = [code for row, code in enumerate(self.codes) if keep[row]]
+        self.index = {code: row for row, code in enumerate(self.codes)}
+        self.amounts, self.cost_basis = self.amounts[keep], self.cost_basis[keep]
+        self.prices, self.priced_at = self.prices[keep], self.priced_at[keep]
+
+    # The holdings as plain lists we can save as json, a cost basis we were never told is None
+    # Prices are not saved, they are out of date by the time anyone loads them
+    def holdings(self):
+        return {"codes": list(self.codes), "amounts": self.amounts.tolist(),
+                "cost_basis": [None if math.isnan(cost) else cost for cost in self.cost_basis.tolist()]}
+
+    # Put back holdings saved with holdings(), they are priced again the next time the portfolio is valued
+    def restore(self, holdings):
+        self.remove(list(self.codes))
+        self.update(holdings["codes"], holdings["amounts"], holdings["cost_basis"])
+
+    # The holdings were added to or changed
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change(self.holdings())
+
+    # The coins whose price is missing or older than max_age seconds
+    def stale(self, max_age):
+        old = time.monotonic() - self.priced_at > max_age
+        return [code for code, is_old in zip(self.codes, old | np.isnan(self.prices)) if is_old]
+
+    # Save prices from a {code: price} dict
+    def set_prices(self, prices):
+        now = time.monotonic()
+        for code, price in prices.items():
+            row = self.index.get(code)
+            if row is not None:
+                self.prices[row] = price
+                self.priced_at[row] = now
+
+    # Value, weight and profit of every coin, plus the totals, coins without a price are left out of the totals
+    def valuation(self):
+        values = self.amounts * self.prices
+        priced = ~np.isnan(values)
+        total = float(values[priced].sum())
+        weights = values / total if total else np.zeros(len(values))
+        cost = self.amounts * self.cost_basis
+        profit = values - cost
+        known = priced & ~np.isnan(cost)
+        total_cost = float(cost[known].sum())
+        return {
+            "codes": self.codes, "amounts": self.amounts, "prices": self.prices, "values": values,
+            "weights": weights, "profit": profit, "cost": cost, "total": total,
+            "total_profit": float(profit[known].sum()) if known.any() else None,
+            "total_cost": total_cost,
+        }
@@ -0,0 +1,135 @@
+# standard python library, everything here is built in
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# A small in memory cache for prices
+# Entries expire after ttl seconds, and once we hold max_size entries the least recently used one is thrown out
+# If several threads miss on the same key at the same time, only the first one calls the api,
+# the others wait for its answer instead of all hitting the api at once (a "cache stampede")
+class PriceCache:
+    def __init__(self, ttl=10.0, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (time the entry expires, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+        # key -> Future for the fetch that is currently running for that key
+        self._in_flight = {}
+        # Same idea for async code, but these are asyncio futures so waiting on them does not block the event loop
+        self._in_flight_async = {}
+        self._lock = threading.Lock()
+
+    # Return the cached value for key, or None if it is missing or too old
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    # Store a value for key, evicting the oldest entries if the cache is full
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    # Return the cached value for key, calling fetch() to fill the cache on a miss
+    # fetch returning None means "no answer", which we hand back but never cache
+    def get_or_fetch(self, key, fetch):
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            call = self._in_flight.get(key)
+            # Somebody else is already fetching this key, so wait for them
+            if call is not None:
+                leader = False
+            else:
+                call = Future()
+                self._in_flight[key] = call
+                leader = True
+        if not leader:
+            return call.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            # Hand the error to everyone that was waiting on us too
+            call.set_exception(e)
+            raise
+        with self._lock:
+            if value is not None:
+                self._set(key, value)
+            del self._in_flight[key]
+        call.set_result(value)
+        return value
+
+    # The async version of get_or_fetch, fetch is a coroutine function here
+    # Waiting callers await the leader's asyncio future, so other sessions keep running meanwhile
+    async def get_or_fetch_async(self, key, fetch):
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            call = self._in_flight_async.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = asyncio.get_running_loop().create_future()
+                self._in_flight_async[key] = call
+                leader = True
+        if not leader:
+            # shield, so one waiter being cancelled does not cancel the fetch for everyone else
+            return await asyncio.shield(call)
+
+        try:
+            value = await fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight_async[key]
+            if isinstance(e, asyncio.CancelledError):
+                call.cancel()
+            else:
+                call.set_exception(e)
+                # Nobody may be waiting, mark the error as seen so asyncio does not complain about it
+                call.exception()
+            raise
+        with self._lock:
+            if value is not None:
+                self._set(key, value)
+            del self._in_flight_async[key]
+        call.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # The two helpers below expect the lock to already be held
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        # Mark the entry as most recently used
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# The cache every price function shares, keyed by (fsym, tsym, exchange)
+# The ttl and size can be changed from the .env file without touching the code
+price_cache = PriceCache(
+    ttl=float(os.environ.get("PRICE_CACHE_TTL", 10)),
+    max_size=int(os.environ.get("PRICE_CACHE_SIZE", 1024)),
+)
@@ -0,0 +1,130 @@
+# Keeps the latest price of every coin people are asking about, so the price functions can answer without calling the api
+# A background task refreshes all of them with one bulk request every few seconds,
+# and a coin stops being refreshed once no session has asked about it for a while
+# standard python library, everything here is built in
+import asyncio
+import contextvars
+import os
+import time
+
+from .display import print_error
+
+
+# fetch_quotes is an async function that takes a list of coin codes and returns {code: raw price data}
+# It is passed in, so the feed can be pointed at the real api, a local stand-in, or a fake in a test
+# A source that pushes prices to us (e.g. a websocket) can call update() instead of being polled
+class PriceFeed:
+    def __init__(self, fetch_quotes, interval=5.0, max_age=None, idle=300.0):
+        self.fetch_quotes = fetch_quotes
+        # Seconds between refreshes
+        self.interval = interval
+        # A quote older than this is not used, e.g. when the api has been failing for a while
+        self.max_age = max_age if max_age is not None else 2 * interval
+        # Seconds a session can go without asking for a price before its coins stop being refreshed
+        self.idle = idle
+        # code -> (raw price data, when we got it)
+        self.quotes = {}
+        # session id -> [the codes it asked about, when it last asked]
+        self.sessions = {}
+        # code -> how many sessions are watching it, so a lookup never has to go through every session
+        self.watchers = {}
+        self._task = None
+        self._wakeup = None
+
+    # Remember that a session wants these coins kept up to date
+    # A coin nobody was watching yet gets fetched right away instead of at the next refresh
+    def subscribe(self, session_id, codes):
+        entry = self.sessions.setdefault(session_id, [set(), 0.0])
+        entry[1] = time.monotonic()
+        unwatched = False
+        for code in codes:
+            if code in entry[0]:
+                continue
+            entry[0].add(code)
+            unwatched = unwatched or code not in self.watchers
+            self.watchers[code] = self.watchers.get(code, 0) + 1
+        if self._task is not None and unwatched:
+            self._wakeup.set()
+
+    def unsubscribe(self, session_id):
+        entry = self.sessions.pop(session_id, None)
+        if entry is None:
+            return
+        for code in entry[0]:
+            self.watchers[code] -= 1
+            if not self.watchers[code]:
+                del self.watchers[code]
+
+    # Forget the sessions that have not asked for a price in idle seconds, this runs once every refresh
+    def expire(self):
+        cutoff = time.monotonic() - self.idle
+        for session_id in [session_id for session_id, (_, seen) in self.sessions.items() if seen < cutoff]:
+            self.unsubscribe(session_id)
+
+    # Every coin an active session is watching
+    def symbols(self):
+        return set(self.watchers)
+
+    def update(self, code, raw_data):
+        self.quotes[code] = (raw_data, time.monotonic())
+
+    # The latest raw price data for a coin, or None if we don't have a fresh one
+    def quote(self, code):
+        entry = self.quotes.get(code)
+        if entry is None or time.monotonic() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    # Fetch every watched coin once, and drop the quotes for coins nobody watches anymore
+    async def refresh(self):
+        self.expire()
+        codes = self.symbols()
+        for code in [code for code in self.quotes if code not in codes]:
+            del self.quotes[code]
+        if codes:
+            for code, raw_data in (await self.fetch_quotes(sorted(codes))).items():
+                self.update(code, raw_data)
+
+    # Start refreshing in the background, this has to be called from inside the event loop
+    # It is started once, next to where it is stopped (see startup() in conversation.py), not by whichever turn
+    # subscribes first, until then subscribe() only remembers the coins
+    # The task gets a context of its own: a task copies the context of the code that made it,
+    # and the feed must not keep the deadline, session or trace of whatever code started it, or every refresh
+    # would be timed under that code's trace (and turned away once its deadline passed)
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                # Keep going, the quotes just get old and the price functions go back to asking the api
+                print_error(f"could not refresh prices: {e}")
+            # Sleep until the next refresh, or until someone subscribes to a new coin
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Make the price feed the .env file asks for, or None if it is turned off
+# PRICE_FEED turns it on or off, PRICE_FEED_INTERVAL and PRICE_FEED_IDLE are in seconds
+def open_price_feed(fetch_quotes):
+    if os.environ.get("PRICE_FEED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return PriceFeed(fetch_quotes,
+                     interval=float(os.environ.get("PRICE_FEED_INTERVAL", 5)),
+                     idle=float(os.environ.get("PRICE_FEED_IDLE", 300)))
@@ -0,0 +1,166 @@
+# Keeps price history (candles: open, high, low, close and volume for every minute, hour or day) on disk
+# Each coin and interval gets a folder with one file per column, the raw numbers back to back,
+# so reading a range is a memory map and a slice instead of parsing anything,
+# and new candles are added by appending to the end of each file instead of rewriting it
+# Only candles that are finished get saved, so once a candle is on disk it never has to be fetched again
+# standard python library
+import asyncio
+import os
+import threading
+import time
+# pip install numpy, only imported the first time it is used, see lazy.py
+from .lazy import lazy_import
+np = lazy_import("numpy")
+
+# The columns we keep, and how each one is stored
+COLUMNS = {"time": "int64", "open": "float64", "high": "float64", "low": "float64",
+           "close": "float64", "volumefrom": "float64", "volumeto": "float64"}
+# Seconds in one candle of each interval
+INTERVALS = {"minute": 60, "hour": 3600, "day": 86400}
+# The most candles the api gives back in one request
+MAX_BARS_PER_REQUEST = 2000
+
+
+# The urls to fetch every candle from start to end (both are candle times), newest chunk first
+def history_urls(base_url, symbol, interval, start, end, tsym="USD", exchange="coinbase"):
+    step = INTERVALS[interval]
+    urls = []
+    while end >= start:
+        # limit=n gives back n + 1 candles, ending at toTs
+        bars = min(MAX_BARS_PER_REQUEST, (end - start) // step + 1)
+        urls.append(f"{base_url}/data/v2/histo{interval}?fsym={symbol}&tsym={tsym}&e={exchange}"
+                    f"&limit={bars - 1}&toTs={end}")
+        end -= bars * step
+    return urls
+
+
+# Turn the api's json into columns, keeping only the candles between start and end
+def parse_bars(data, start, end):
+    bars = [bar for bar in ((data.get("Data") or {}).get("Data") or []) if start <= bar["time"] <= end]
+    return {name: np.array([bar.get(name, 0) for bar in bars], dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+# Join several chunks of columns into one, sorted by time with no candle twice
+def merge_bars(chunks):
+    columns = {name: np.concatenate([chunk[name] for chunk in chunks] or [np.empty(0, dtype)])
+               for name, dtype in COLUMNS.items()}
+    times, keep = np.unique(columns["time"], return_index=True)
+    return {name: column[keep] for name, column in columns.items()}
+
+
+class PriceHistory:
+    def __init__(self, directory):
+        self.directory = directory
+        # One lock per coin and interval, so two threads never write the same files at once
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Async code waits on these instead, so it never blocks the event loop while a fetch is running
+        self._async_locks = {}
+
+    def _folder(self, key):
+        symbol, tsym, interval = key
+        return os.path.join(self.directory, f"{symbol}-{tsym}-{interval}")
+
+    def _lock(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    # Every saved candle for a key, as memory mapped columns (nothing is read until it is used)
+    def load(self, key):
+        folder = self._folder(key)
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(folder, f"{name}.bin")
+            size = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(size,)) if size else np.empty(0, dtype)
+        # If we stopped partway through an append, some columns can be one candle longer, ignore the extra
+        rows = min(len(column) for column in columns.values())
+        return {name: column[:rows] for name, column in columns.items()}
+
+    # Save new candles for a key
+    # Candles after the last saved one are appended, if the new candles start before the saved ones
+    # (someone asked for a longer window than we have) the files are replaced instead
+    # If the new candles start after a hole (nobody asked about this coin for longer than the window),
+    # they replace the saved ones: missing() only looks at the first and last saved candle,
+    # so it would take the hole for candles we have
+    def store(self, key, bars):
+        if not len(bars["time"]):
+            return
+        with self._lock(key):
+            saved = self.load(key)
+            folder = self._folder(key)
+            os.makedirs(folder, exist_ok=True)
+            if len(saved["time"]) and bars["time"][0] < saved["time"][0]:
+                self._replace(folder, merge_bars([saved, bars]))
+                return
+            if len(saved["time"]) and bars["time"][0] > saved["time"][-1] + INTERVALS[key[2]]:
+                self._replace(folder, bars)
+                return
+            last = saved["time"][-1] if len(saved["time"]) else -1
+            newer = bars["time"] > last
+            # time goes last, so a crash part way through never leaves a time without its prices
+            for name in sorted(COLUMNS, key=lambda name: name == "time"):
+                with open(os.path.join(folder, f"{name}.bin"), "ab") as file:
+                    file.write(np.ascontiguousarray(bars[name][newer], dtype=COLUMNS[name]).tobytes())
+
+    # Write new files and swap them in, anyone still reading the old ones keeps their copy
+    @staticmethod
+    def _replace(folder, bars):
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(folder, f"{name}.bin")
+            with open(path + ".tmp", "wb") as file:
+                file.write(np.ascontiguousarray(bars[name], dtype=dtype).tobytes())
+            os.replace(path + ".tmp", path)
+
+    # The time of the newest finished candle, and of the first candle in a window of that many candles
+    @staticmethod
+    def window_range(interval, window, now=None):
+        step = INTERVALS[interval]
+        # The candle that started most recently is still going, so the newest finished one is the one before it
+        end = int((now if now is not None else time.time()) // step) * step - step
+        return end - (window - 1) * step, end
+
+    # Which candles we still have to fetch to answer a window, as (start, end), or None if we have them all
+    # Never more than the window: if the saved candles end before it starts, only the window is fetched
+    # (and store() replaces the old candles with it), so a coin nobody asked about for a month costs
+    # the same as one asked about a minute ago
+    def missing(self, key, interval, window, now=None):
+        start, end = self.window_range(interval, window, now)
+        times = self.load(key)["time"]
+        if not len(times) or times[0] > start:
+            return start, end
+        if times[-1] < end:
+            return max(int(times[-1]) + INTERVALS[interval], start), end
+        return None
+
+    # The saved candles between start and end, as columns
+    def read(self, key, start, end):
+        columns = self.load(key)
+        first = np.searchsorted(columns["time"], start, side="left")
+        last = np.searchsorted(columns["time"], end, side="right")
+        return {name: column[first:last] for name, column in columns.items()}
+
+    # The last `window` finished candles of a coin, fetching only the ones we don't have yet
+    # fetch(start, end) has to return the candles from start to end as columns
+    def get(self, symbol, interval, window, fetch, tsym="USD"):
+        key = (symbol, tsym, interval)
+        start, end = self.window_range(interval, window)
+        gap = self.missing(key, interval, window)
+        if gap is not None:
+            self.store(key, fetch(*gap))
+        return self.read(key, start, end)
+
+    async def get_async(self, symbol, interval, window, fetch, tsym="USD"):
+        key = (symbol, tsym, interval)
+        start, end = self.window_range(interval, window)
+        # One fetch per coin and interval at a time, anyone else asking waits for it and then reads from disk
+        async with self._async_locks.setdefault(key, asyncio.Lock()):
+            gap = self.missing(key, interval, window)
+            if gap is not None:
+                self.store(key, await fetch(*gap))
+        return self.read(key, start, end)
+
+
+# Make the price history the .env file asks for, PRICE_HISTORY_DIR is the folder the candles are saved in
+def open_price_history():
+    return PriceHistory(os.environ.get("PRICE_HISTORY_DIR", "price_history"))
@@ -0,0 +1,186 @@
+# Keeps us under the limits the apis put on how often we call them
+# CryptoCompare's free tier allows so many requests a minute, and OpenAI so many requests and tokens a minute
+# Going over means 429 errors, and once those start every user gets "The function failed to run"
+# Instead we pace the calls ourselves: each api has token buckets that refill at its per minute limit,
+# and a call that would go over waits its turn, so under load we go exactly as fast as the limit allows
+# A call that would have to wait past its deadline is turned away straight away with RateLimited,
+# since by then nobody is waiting for the answer anymore
+# standard python library, everything here is built in
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from .tracing import metrics
+
+# A bucket holds this many seconds worth of its limit, so a quiet api can take a small burst all at once
+# The apis check their limits over short windows too, so a bigger burst would still get 429s
+BURST_SECONDS = 1
+
+
+# Raised when a call to an api would have to wait past its deadline
+# retry_after is about how many seconds until it would go through
+class RateLimited(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Refills at per_minute / 60 every second, up to BURST_SECONDS worth
+# Taking from it can leave it below zero: the calls after that wait until it has refilled past what they need,
+# which lines them up one after another at exactly the limit, oldest first
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take amount out of the bucket, returns how many seconds to wait before using it
+    # If that wait would be longer than max_wait nothing is taken and None is returned
+    def reserve(self, amount, max_wait):
+        with self._lock:
+            self._refill()
+            # A call bigger than the whole bucket could never fit, so it goes once the bucket is full,
+            # but all of it is still taken: the bucket goes below zero and the calls after it wait that much longer,
+            # so over a minute we never use more than the limit
+            wait = max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self.tokens -= amount
+            return wait
+
+    # Put back tokens we took but did not use, or take more (a negative amount) if we used more than we guessed
+    def refund(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    # The api told us to slow down, so nothing else goes through for the next seconds
+    def pause(self, seconds):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -self.rate * seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+# When the turn running right now stops being worth waiting for, as a time.monotonic() time
+# handle_turn sets it, calls made outside a turn only have the upstream's max_wait
+deadline = contextvars.ContextVar("deadline", default=None)
+
+# The most upstream requests (price api and AI api together) that can be open at once
+# Anything past this waits its turn, instead of piling more load on apis that are already slow
+# Async code and threads each get this many, set MAX_INFLIGHT_UPSTREAM in the .env file to change it
+max_inflight = int(os.environ.get("MAX_INFLIGHT_UPSTREAM", 64))
+upstream_slots = asyncio.Semaphore(max_inflight)
+upstream_thread_slots = threading.BoundedSemaphore(max_inflight)
+
+
+# The limits for one api
+# requests_per_minute and tokens_per_minute of 0 mean no limit, tokens are only counted for the AI
+# max_wait is the longest a call waits for its turn when it has no deadline of its own
+class Upstream:
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_wait=10.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_wait = max_wait
+
+    # How long a call starting now may wait
+    def time_left(self):
+        end = deadline.get()
+        if end is None:
+            return self.max_wait
+        return min(self.max_wait, end - time.monotonic())
+
+    # Take one request and `tokens` tokens, returns the seconds to wait before calling or raises RateLimited
+    def reserve(self, tokens=0):
+        # A call made after its deadline has passed is not worth making at all, however empty the api is
+        # Only a call with no deadline (deadline is None) is left to max_wait
+        end = deadline.get()
+        if end is not None and end <= time.monotonic():
+            metrics.inc("stockbroker_upstream_expired_total", upstream=self.name)
+            raise RateLimited(f"the turn ran out of time before it could call the {self.name} api")
+        max_wait = self.time_left()
+        request_wait = self.requests.reserve(1, max_wait) if self.requests else 0.0
+        if request_wait is None:
+            self.reject(self.requests, 1)
+        token_wait = self.tokens.reserve(tokens, max_wait) if self.tokens and tokens else 0.0
+        if token_wait is None:
+            # Give back the request we took, since this call is not happening
+            if self.requests:
+                self.requests.refund(1)
+            self.reject(self.tokens, tokens)
+        wait = max(request_wait, token_wait)
+        if wait:
+            metrics.inc("stockbroker_upstream_throttled_total", upstream=self.name)
+        return wait
+
+    def reject(self, bucket, amount):
+        metrics.inc("stockbroker_upstream_rejected_total", upstream=self.name)
+        retry_after = round(max(0.0, amount - bucket.tokens) / bucket.rate, 1)
+        raise RateLimited(f"the {self.name} api is busy, try again in about {retry_after} seconds", retry_after)
+
+    # We guessed `estimated` tokens before the call, and the api says it used `used`
+    def settle(self, estimated, used):
+        if self.tokens and used is not None:
+            self.tokens.refund(estimated - used)
+
+    # The api answered 429, so hold every call to it back for a while
+    def pause(self, seconds):
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.pause(seconds)
+
+    # Wait for our turn to call this api from async code: first for the rate limit, then for a free slot
+    # Raises RateLimited instead if either would take past the deadline
+    @asynccontextmanager
+    async def call(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        # A free slot is taken straight away, only a call that has to wait for one needs the timeout
+        if upstream_slots.locked():
+            try:
+                await asyncio.wait_for(upstream_slots.acquire(), max(0.0, self.time_left()))
+            except asyncio.TimeoutError:
+                metrics.inc("stockbroker_upstream_rejected_total", upstream=self.name)
+                raise RateLimited(f"too many requests to the {self.name} api are already open, try again soon")
+        else:
+            await upstream_slots.acquire()
+        try:
+            yield
+        finally:
+            upstream_slots.release()
+
+    # The same for code running in threads, it blocks the thread while it waits
+    @contextmanager
+    def call_sync(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        if not upstream_thread_slots.acquire(timeout=max(0.001, self.time_left())):
+            metrics.inc("stockbroker_upstream_rejected_total", upstream=self.name)
+            raise RateLimited(f"too many requests to the {self.name} api are already open, try again soon")
+        try:
+            yield
+        finally:
+            upstream_thread_slots.release()
+
+
+# The limits for each api, set them to what your account allows in the .env file
+# UPSTREAM_MAX_WAIT is the longest a call waits for its turn before we give up on it
+cryptocompare_limits = Upstream("cryptocompare",
+                                requests_per_minute=float(os.environ.get("CRYPTOCOMPARE_RPM", 300)),
+                                max_wait=float(os.environ.get("UPSTREAM_MAX_WAIT", 10)))
+openai_limits = Upstream("openai",
+                         requests_per_minute=float(os.environ.get("OPENAI_RPM", 3500)),
+                         tokens_per_minute=float(os.environ.get("OPENAI_TPM", 90000)),
+                         max_wait=float(os.environ.get("UPSTREAM_MAX_WAIT", 10)))
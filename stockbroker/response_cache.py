@@ -0,0 +1,184 @@
+# Remembers the AI's answers to general questions, so the next person asking the same thing gets the answer at once
+# Many people ask nearly the same question ("what is a stop-loss order?"), and the answer does not change,
+# so there is no need to wait seconds and pay for the AI to write it again
+# First we look for the exact question (after tidying it up), which is one dictionary lookup
+# If that misses, and RESPONSE_CACHE_SIMILARITY is set below 1, we look for a question that is worded nearly the same,
+# by comparing the letter triples (trigrams) in them
+# That is off by default: questions one letter apart can want different answers ("stock and bond" vs "stock and fund",
+# "in 2024" vs "in 2025"), and letter triples can not tell those apart from a typo
+# Only answers that needed no functions are saved, anything with a price in it would be out of date
+# standard python library, everything here is built in
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Short forms we spell out, so "what's" and "what is" count as the same question
+CONTRACTIONS = {"what's": "what is", "whats": "what is", "it's": "it is", "how's": "how is", "who's": "who is",
+                "where's": "where is", "that's": "that is", "there's": "there is", "can't": "can not",
+                "cannot": "can not", "don't": "do not", "doesn't": "does not", "isn't": "is not"}
+# Words that point back at the conversation or at the user, an answer to these depends on who is asking,
+# e.g. "can you explain that again?" or "what is my name?", so they are never answered from the cache
+PERSONAL_WORDS = re.compile(r"\b(?:it|its|that|this|those|these|they|them|their|he|she|him|her|i|me|my|mine|we|us|our|"
+                            r"above|earlier|before|previous|again|more|else|also|instead)\b")
+
+
+# Tidy a question up so small differences in how it was typed don't matter
+# "What's a Stop-Loss order??" and "what is a stop loss order" both become "what is a stop loss order"
+def normalize(text):
+    words = re.findall(r"[a-z0-9']+", text.lower().replace("-", " "))
+    return " ".join(CONTRACTIONS.get(word, word) for word in words)
+
+
+# Whether a question can be answered from the cache at all
+def cacheable(question):
+    return bool(question) and PERSONAL_WORDS.search(question) is None
+
+
+# The letter triples in a question, padded so the first and last letters count too
+def trigrams(question):
+    padded = f"  {question} "
+    return frozenset(padded[index:index + 3] for index in range(len(padded) - 2))
+
+
+# How alike two sets of trigrams are (their cosine similarity), 1 is the same question and 0 shares no trigrams at all
+def similarity(first, second):
+    return len(first & second) / math.sqrt(len(first) * len(second))
+
+
+# Entries expire after ttl seconds, and once we hold max_size entries the least recently used one is thrown out
+# scope keeps apart answers that can not stand in for each other, e.g. the model and system prompt they were written with
+# min_similarity is how alike a question has to be to a saved one to get its answer, 1 turns the similar lookup off
+class ResponseCache:
+    def __init__(self, ttl=3600.0, max_size=1024, min_similarity=1.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.min_similarity = min_similarity
+        # (scope, question) -> (time the entry expires, answer, trigrams), least recently used first
+        self._entries = OrderedDict()
+        # (scope, trigram) -> keys of the entries with that trigram, so we only compare against questions that share some
+        self._index = {}
+        # (scope, question) -> asyncio future for a question the AI is answering right now, see get_async
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    # The saved answer for a question, or None
+    def get(self, scope, text):
+        question = normalize(text)
+        if not cacheable(question):
+            return None
+        with self._lock:
+            return self._get(scope, question)
+
+    # The async version of get
+    # If somebody is asking the AI the same question right now, we wait for their answer instead of asking too,
+    # otherwise the question is marked as being answered until finish is called for it
+    async def get_async(self, scope, text):
+        question = normalize(text)
+        if not cacheable(question):
+            return None
+        with self._lock:
+            answer = self._get(scope, question)
+            if answer is not None:
+                return answer
+            pending = self._pending.get((scope, question))
+            if pending is None:
+                self._pending[(scope, question)] = asyncio.get_running_loop().create_future()
+                return None
+        # shield, so one waiter being cancelled does not cancel the wait for everyone else
+        return await asyncio.shield(pending)
+
+    # Call when a turn that missed in get_async is over, with its answer, or None if the answer can not be reused
+    # Everyone waiting on the same question gets the answer, or with None goes on to ask the AI themselves
+    def finish(self, scope, text, answer):
+        if answer:
+            self.set(scope, text, answer)
+        with self._lock:
+            pending = self._pending.pop((scope, normalize(text)), None)
+        if pending is not None and not pending.done():
+            pending.set_result(answer or None)
+
+    # Save the answer to a question
+    def set(self, scope, text, answer):
+        question = normalize(text)
+        if not cacheable(question) or not answer:
+            return
+        grams = trigrams(question)
+        with self._lock:
+            key = (scope, question)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, answer, grams)
+            for gram in grams:
+                self._index.setdefault((scope, gram), set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    # The helpers below expect the lock to already be held
+    def _get(self, scope, question):
+        now = time.monotonic()
+        key = (scope, question)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[1]
+        if self.min_similarity < 1:
+            key = self._most_similar(scope, question, now)
+            if key is not None:
+                self._entries.move_to_end(key)
+                return self._entries[key][1]
+        return None
+
+    # The saved question in the same scope most like this one, if it is alike enough and has not expired
+    def _most_similar(self, scope, question, now):
+        grams = trigrams(question)
+        # Two questions can only be min_similarity alike if they share at least min_similarity squared of the trigrams
+        # So a saved question that is alike enough has to have one of the rarest trigrams left over after that many,
+        # and only the questions with one of those are compared, the common trigrams like "wha" are never looked at
+        postings = sorted((self._index.get((scope, gram), ()) for gram in grams), key=len)
+        rarest = len(postings) - math.ceil(self.min_similarity ** 2 * len(postings)) + 1
+        candidates = set().union(*postings[:rarest])
+        # A question with far more or far fewer trigrams can not be alike enough either
+        shortest = self.min_similarity ** 2 * len(grams)
+        longest = len(grams) / self.min_similarity ** 2
+        best_key, best_score = None, self.min_similarity
+        for key in candidates:
+            expires_at, _, other = self._entries[key]
+            if expires_at <= now:
+                self._remove(key)
+                continue
+            if not shortest <= len(other) <= longest:
+                continue
+            score = similarity(grams, other)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def _remove(self, key):
+        _, _, grams = self._entries.pop(key)
+        scope = key[0]
+        for gram in grams:
+            keys = self._index.get((scope, gram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(scope, gram)]
+
+
+# Make the response cache the .env file asks for, or None if it is turned off
+# RESPONSE_CACHE turns it on or off, RESPONSE_CACHE_TTL is in seconds, RESPONSE_CACHE_SIZE is how many answers are kept
+# and RESPONSE_CACHE_SIMILARITY is how alike two questions have to be to share an answer
+def open_response_cache():
+    if os.environ.get("RESPONSE_CACHE", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return ResponseCache(ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 3600)),
+                         max_size=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)),
+                         min_similarity=float(os.environ.get("RESPONSE_CACHE_SIMILARITY", 1)))
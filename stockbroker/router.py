@@ -0,0 +1,120 @@
+# Decides which model, if any, answers a turn
+# Most questions are just "what is the price of X?", which needs no AI at all: we look the price up and answer it ourselves
+# Other questions go to a cheap model, and only the ones that need real analysis go to the bigger one
+# A cheap turn that ends up calling an analysis function (history, indicators, the portfolio) is escalated,
+# so the bigger model explains the numbers
+# Classifying a turn is a couple of regular expressions, so it takes microseconds and no api call
+# standard python library
+import os
+import re
+
+from .tools import get_crypto_price_async, get_crypto_prices_async, tool_failed
+
+# Set MODEL_ROUTER=false in the .env file to send every turn to CHEAP_MODEL, like before
+router_enabled = os.environ.get("MODEL_ROUTER", "true").lower() in ("1", "true", "yes")
+# The model for everyday turns, and the one for turns that need analysis
+cheap_model = os.environ.get("CHEAP_MODEL", "gpt-3.5-turbo")
+strong_model = os.environ.get("STRONG_MODEL", "gpt-4o")
+# Messages longer than this many words are usually asking for something involved, so they go to the bigger model
+escalate_words = int(os.environ.get("ESCALATE_WORDS", 60))
+
+# Names people use for the common coins, and their codes
+COIN_CODES = {
+    "bitcoin": "BTC", "btc": "BTC", "ethereum": "ETH", "ether": "ETH", "eth": "ETH", "solana": "SOL", "sol": "SOL",
+    "dogecoin": "DOGE", "doge": "DOGE", "cardano": "ADA", "ada": "ADA", "ripple": "XRP", "xrp": "XRP",
+    "litecoin": "LTC", "ltc": "LTC", "polkadot": "DOT", "dot": "DOT", "avalanche": "AVAX", "avax": "AVAX",
+    "chainlink": "LINK", "link": "LINK", "polygon": "MATIC", "matic": "MATIC", "tron": "TRX", "trx": "TRX",
+    "shiba inu": "SHIB", "shib": "SHIB", "tether": "USDT", "usdt": "USDT", "bnb": "BNB", "binance coin": "BNB",
+    "stellar": "XLM", "xlm": "XLM", "monero": "XMR", "xmr": "XMR", "uniswap": "UNI", "uni": "UNI",
+}
+# The name we say in the reply for each code, e.g. "The price of bitcoin is $X"
+COIN_NAMES = {"BTC": "bitcoin", "ETH": "ethereum", "SOL": "solana", "DOGE": "dogecoin", "ADA": "cardano",
+              "XRP": "XRP", "LTC": "litecoin", "DOT": "polkadot", "AVAX": "avalanche", "LINK": "chainlink",
+              "MATIC": "polygon", "TRX": "tron", "SHIB": "shiba inu", "USDT": "tether", "BNB": "BNB",
+              "XLM": "stellar", "XMR": "monero", "UNI": "uniswap"}
+
+# A message that only asks for prices, e.g. "What is the price of bitcoin?", "How much is BTC worth right now?"
+# or "ETH and SOL prices", the coins are checked separately
+PRICE_LOOKUP = re.compile(r"""
+    ^(?:please\s+)?
+    (?:
+        (?:(?:what(?:'s|s|\s+is|\s+are)|tell\s+me|give\s+me|show\s+me|check|get)\s+)?
+        (?:the\s+)?(?:(?:current|latest|live|spot)\s+)?(?:price|value|quote)s?\s+(?:of|for|on)\s+(?P<after>.+?)
+      | how\s+much\s+(?:is|are|does|do)\s+(?:a\s+|one\s+)?(?P<worth>.+?)
+        (?:\s+(?:worth|cost|going\s+for|trading\s+at|selling\s+for))?
+      | (?:the\s+)?(?P<before>.+?)\s+prices?
+    )
+    (?:\s+(?:right\s+now|now|today|currently|at\s+the\s+moment))?
+    (?:\s+(?:in\s+)?(?:usd|dollars))?
+    (?:\s+please)?$
+""", re.IGNORECASE | re.VERBOSE)
+# Splits "BTC, ETH and SOL" into the coins
+COIN_SEPARATOR = re.compile(r"\s*(?:,|&|/|\+|\band\b)\s*", re.IGNORECASE)
+# Words that mean the user wants more than a number
+ANALYSIS_WORDS = re.compile(r"""\b(?:
+    analy[sz]\w* | compar\w* | trend\w* | predict\w* | forecast\w* | should\s+i | strateg\w* | recommend\w* | outlook
+    | rsi | macd | moving\s+averages? | bollinger | volatil\w* | indicators? | portfolio | holdings? | histor\w*
+    | over\s+the\s+(?:last|past) | risk\w* | invest\w* | why
+)\b""", re.IGNORECASE | re.VERBOSE)
+
+
+# Where a turn goes: kind is "price" (answered without the AI), "simple" or "analysis"
+# model is the model to ask, and coins are the codes a price lookup asks for
+class Route:
+    def __init__(self, kind, model=None, coins=()):
+        self.kind = kind
+        self.model = model
+        self.coins = coins
+
+
+# The coin codes a message asks the price of, or None if it asks for anything else
+def price_lookup(text):
+    match = PRICE_LOOKUP.match(text.strip().rstrip("?!. "))
+    if match is None:
+        return None
+    codes = []
+    for coin in COIN_SEPARATOR.split(match.group("after") or match.group("worth") or match.group("before")):
+        coin = re.sub(r"^the\s+", "", coin, flags=re.IGNORECASE)
+        if not coin:
+            continue
+        code = COIN_CODES.get(coin.lower())
+        # A coin we don't know the name of still counts if it was written as a code, e.g. PEPE
+        if code is None and coin.isalpha() and coin.isupper() and 2 <= len(coin) <= 6:
+            code = coin
+        if code is None:
+            return None
+        codes.append(code)
+    # dict.fromkeys drops repeats but keeps the order
+    return list(dict.fromkeys(codes)) or None
+
+
+def needs_analysis(text):
+    return ANALYSIS_WORDS.search(text) is not None or len(text.split()) > escalate_words
+
+
+# Pick where a turn goes, from the user's message alone
+def classify(text):
+    if not router_enabled:
+        return Route("simple", cheap_model)
+    coins = price_lookup(text)
+    if coins:
+        return Route("price", coins=coins)
+    if needs_analysis(text):
+        return Route("analysis", strong_model)
+    return Route("simple", cheap_model)
+
+
+# Where a turn goes once it turns out to need analysis after all
+def escalate(route):
+    return Route("analysis", strong_model) if router_enabled else route
+
+
+# Answer a price lookup with the price functions, or None if they failed and the AI should handle the turn
+async def answer_price_lookup(route):
+    if len(route.coins) == 1:
+        code = route.coins[0]
+        result = await get_crypto_price_async(COIN_NAMES.get(code, code), code)
+    else:
+        result = await get_crypto_prices_async(route.coins)
+    # The sentence for the user, the same one the AI would have written from the price
+    return None if tool_failed(result) else str(result)
@@ -0,0 +1,345 @@
+# Serve the stockbroker to many people at once over HTTP and WebSockets
+# Everything runs on one asyncio event loop using only the standard library, every client gets their own session
+# Usage (from the top of the repo):
+#   python -m stockbroker serve --port 8000
+# Endpoints:
+#   POST /sessions/<id>/messages   body {"message": "..."}, answers {"session_id": ..., "reply": ...}
+#   GET  /sessions/<id>            the messages the session currently sends to the AI
+#   GET  /ws?session_id=<id>       WebSocket, send a message as text and get {"reply": ...} back
+#   GET  /health                   {"status": "ok"} plus how busy we are
+#   GET  /metrics                  timing metrics in the Prometheus text format
+# standard python library, everything here is built in
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+# The conversation pipeline, each session is one handle_turn session
+from . import conversation
+from .messages import dumps, encode_messages
+from .rate_limit import RateLimited
+from .tracing import metrics
+
+# Sent back with every WebSocket handshake, it is fixed by the WebSocket standard
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# The biggest request body or WebSocket message we accept, in bytes
+MAX_BODY = 64 * 1024
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+# Raised when we are too busy to take another turn, status is what we answer with
+class Overloaded(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Decides whether a new turn can run, and makes it wait if we are already busy
+# At most max_turns turns run at once, and at most max_waiting more wait for a free spot;
+# anything past that is turned away straight away, so a flood of requests can not pile up forever
+# Each session may also only have max_per_session turns queued, since its turns run one at a time anyway
+class TurnGate:
+    def __init__(self, max_turns, max_waiting, max_per_session):
+        self.slots = asyncio.Semaphore(max_turns)
+        self.max_waiting = max_waiting
+        self.max_per_session = max_per_session
+        self.running = 0
+        self.waiting = 0
+        self.per_session = {}
+
+    async def run(self, session_id, user_text):
+        if self.per_session.get(session_id, 0) >= self.max_per_session:
+            raise Overloaded(429, "this session already has too many messages waiting")
+        if self.slots.locked() and self.waiting >= self.max_waiting:
+            raise Overloaded(503, "the server is busy, try again soon")
+        self.per_session[session_id] = self.per_session.get(session_id, 0) + 1
+        try:
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            try:
+                return await conversation.handle_turn(session_id, user_text)
+            finally:
+                self.running -= 1
+                self.slots.release()
+        finally:
+            self.per_session[session_id] -= 1
+            if not self.per_session[session_id]:
+                del self.per_session[session_id]
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        url = urlparse(target)
+        self.path = url.path
+        self.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"{}")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Read one HTTP request off the connection, or return None if the client hung up
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "malformed Content-Length")
+    if length < 0:
+        raise HTTPError(400, "malformed Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, headers, body)
+
+
+async def send_response(writer, status, body, content_type="application/json", keep_alive=True):
+    data = body if isinstance(body, bytes) else (body if isinstance(body, str) else json.dumps(body)).encode()
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode() + data)
+    # Wait for the client to take the data, so a slow reader slows us down instead of filling our memory
+    await writer.drain()
+
+
+# The WebSocket protocol: a handshake over HTTP, then messages sent as small binary frames
+async def websocket_handshake(writer, request):
+    key = request.headers.get("sec-websocket-key")
+    if request.headers.get("upgrade", "").lower() != "websocket" or not key:
+        raise HTTPError(400, "expected a websocket upgrade")
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                  "Upgrade: websocket\r\n"
+                  "Connection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+    await writer.drain()
+
+
+# Read one frame, returns (opcode, payload)
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    final = first & 0x80
+    masked = second & 0x80
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_BODY:
+        raise HTTPError(413, "websocket message too large")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return opcode, final, payload
+
+
+# Read one whole message, putting fragmented messages back together and answering pings on the way
+# Returns None when the client closes the connection
+async def read_message(reader, writer):
+    parts = []
+    message_opcode = None
+    while True:
+        opcode, final, payload = await read_frame(reader)
+        if opcode == 0x8:
+            await send_frame(writer, 0x8, payload[:2])
+            return None
+        if opcode == 0x9:
+            await send_frame(writer, 0xA, payload)
+            continue
+        if opcode == 0xA:
+            continue
+        if opcode != 0x0:
+            message_opcode = opcode
+        parts.append(payload)
+        if sum(map(len, parts)) > MAX_BODY:
+            raise HTTPError(413, "websocket message too large")
+        if final:
+            return message_opcode, b"".join(parts)
+
+
+async def send_frame(writer, opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    writer.write(header + payload)
+    await writer.drain()
+
+
+async def send_json_frame(writer, body):
+    await send_frame(writer, 0x1, json.dumps(body).encode())
+
+
+class ChatServer:
+    def __init__(self, max_turns=32, max_waiting=256, max_per_session=4):
+        self.gate = TurnGate(max_turns, max_waiting, max_per_session)
+
+    # One connection, which can carry many HTTP requests one after another (keep-alive), or become a WebSocket
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await send_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    return
+                if request is None:
+                    return
+                if request.path == "/ws":
+                    await self.handle_websocket(reader, writer, request)
+                    return
+                status, body, content_type = await self.route(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await send_response(writer, status, body, content_type, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, request):
+        parts = [part for part in request.path.split("/") if part]
+        try:
+            if parts == ["health"]:
+                return 200, {"status": "ok", "sessions": len(conversation.sessions),
+                             "running_turns": self.gate.running, "waiting_turns": self.gate.waiting}, "application/json"
+            if parts == ["metrics"]:
+                return 200, metrics.render(), "text/plain; version=0.0.4"
+            if len(parts) == 2 and parts[0] == "sessions":
+                if request.method != "GET":
+                    raise HTTPError(405, "use GET")
+                if parts[1] not in conversation.sessions:
+                    raise HTTPError(404, "no such session")
+                # The messages already keep their own json, so they are joined together instead of encoded again
+                messages = encode_messages(conversation.sessions[parts[1]].message_list.messages())
+                return 200, f'{{"session_id":{dumps(parts[1])},"messages":{messages}}}', "application/json"
+            if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+                if request.method != "POST":
+                    raise HTTPError(405, "use POST")
+                try:
+                    user_text = request.json()["message"]
+                except (ValueError, KeyError, TypeError):
+                    user_text = None
+                if not isinstance(user_text, str):
+                    raise HTTPError(400, 'expected a json body like {"message": "..."}')
+                reply = await self.gate.run(parts[1], user_text)
+                return 200, {"session_id": parts[1], "reply": reply}, "application/json"
+            raise HTTPError(404, "not found")
+        except (HTTPError, Overloaded) as e:
+            return e.status, {"error": str(e)}, "application/json"
+        # The AI or the price api is at its rate limit and this turn could not get its turn in time
+        except RateLimited as e:
+            return 503, {"error": str(e), "retry_after": e.retry_after}, "application/json"
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}, "application/json"
+
+    # A WebSocket is one session: each text message is a turn, and the reply goes back as json
+    # We only read the next message once the reply to the last one is sent, which is the backpressure for this client
+    async def handle_websocket(self, reader, writer, request):
+        await websocket_handshake(writer, request)
+        # A random id, not id(writer): python reuses those once a connection is gone, which would hand the next client
+        # the old client's conversation
+        session_id = request.query.get("session_id") or f"ws-{uuid.uuid4().hex}"
+        while True:
+            try:
+                message = await read_message(reader, writer)
+            except HTTPError as e:
+                await send_frame(writer, 0x8, struct.pack("!H", 1009) + str(e).encode())
+                return
+            if message is None:
+                return
+            _, payload = message
+            text = payload.decode("utf-8", "replace")
+            # Accept either plain text or {"message": "..."}
+            if text.startswith("{"):
+                try:
+                    text = json.loads(text)["message"]
+                except (ValueError, KeyError, TypeError):
+                    text = None
+                if not isinstance(text, str):
+                    await send_json_frame(writer, {"error": 'expected text or {"message": "..."}'})
+                    continue
+            try:
+                reply = await self.gate.run(session_id, text)
+            except Overloaded as e:
+                await send_json_frame(writer, {"error": str(e), "status": e.status})
+                continue
+            except RateLimited as e:
+                await send_json_frame(writer, {"error": str(e), "status": 503, "retry_after": e.retry_after})
+                continue
+            except Exception as e:
+                await send_json_frame(writer, {"error": f"{type(e).__name__}: {e}", "status": 500})
+                continue
+            await send_json_frame(writer, {"session_id": session_id, "reply": reply})
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_BODY)
+        conversation.startup()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await conversation.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the stockbroker over HTTP and WebSockets")
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVER_PORT", 8000)))
+    parser.add_argument("--max-turns", type=int, default=int(os.environ.get("SERVER_MAX_TURNS", 32)),
+                        help="turns that can run at the same time")
+    parser.add_argument("--max-waiting", type=int, default=int(os.environ.get("SERVER_MAX_WAITING", 256)),
+                        help="turns that can wait for a free spot before we start turning requests away")
+    parser.add_argument("--max-per-session", type=int, default=int(os.environ.get("SERVER_MAX_PER_SESSION", 4)),
+                        help="turns one session can have queued")
+    args = parser.parse_args(argv)
+    server = ChatServer(args.max_turns, args.max_waiting, args.max_per_session)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Saves every conversation so it survives the program stopping or crashing
+# Each message is saved once, on its own, as soon as it is made (we never rewrite the whole conversation),
+# and when a session comes back we only load its most recent messages
+# A session's portfolio holdings are saved too, as one json object that is replaced every time they change
+# standard python library, everything here is built in
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from .messages import Message, encode, dumps
+from .display import print_error
+
+
+# Keeps sessions in memory only, nothing survives a restart
+# Handy for benchmarks, or when you don't want anything written to disk
+class MemorySessionStore:
+    def __init__(self):
+        self.sessions = {}
+        self.holdings = {}
+        self._lock = threading.Lock()
+
+    def append(self, session_id, message):
+        with self._lock:
+            self.sessions.setdefault(session_id, []).append(message)
+
+    # The last `limit` messages of a session, oldest first
+    def load_recent(self, session_id, limit):
+        with self._lock:
+            return list(self.sessions.get(session_id, ())[-limit:])
+
+    def save_holdings(self, session_id, holdings):
+        with self._lock:
+            self.holdings[session_id] = holdings
+
+    # The holdings saved for a session, or None
+    def load_holdings(self, session_id):
+        with self._lock:
+            return self.holdings.get(session_id)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# What the writer thread runs for each kind of row it is given
+SAVE_MESSAGE = "INSERT INTO messages (session_id, created, message) VALUES (?, ?, ?)"
+SAVE_HOLDINGS = "INSERT OR REPLACE INTO holdings (session_id, holdings) VALUES (?, ?)"
+
+
+# Keeps sessions in a SQLite database file, in WAL mode
+# append() only puts the message on a queue, so it never waits on the disk
+# A background thread takes everything on the queue and writes it in one transaction,
+# so a busy server does one disk write per batch of messages instead of one per message
+# The database is only opened when the first session is saved or loaded, so importing the code touches no files
+class SQLiteSessionStore:
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._reader = None
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+    def _start(self):
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is not None:
+                return
+            # Reads happen on the caller's thread with their own connection, WAL mode lets them run alongside the writer
+            self._reader = self._connect(check_same_thread=False)
+            self._reader.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    message TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+                CREATE TABLE IF NOT EXISTS holdings (
+                    session_id TEXT PRIMARY KEY,
+                    holdings TEXT NOT NULL
+                );
+            """)
+            writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+            writer.start()
+            self._writer = writer
+
+    def _connect(self, **kwargs):
+        connection = sqlite3.connect(self.path, **kwargs)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL is still safe against the program crashing, it only skips syncing on every commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # A Message is saved as the json it already has, so it is never encoded twice
+    def append(self, session_id, message):
+        self._start()
+        self._queue.put((SAVE_MESSAGE, (session_id, time.time(), encode(message))))
+
+    # Holdings go through the same queue, so they are written in the same batches as the messages
+    def save_holdings(self, session_id, holdings):
+        self._start()
+        self._queue.put((SAVE_HOLDINGS, (session_id, dumps(holdings))))
+
+    def load_recent(self, session_id, limit):
+        self._start()
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)).fetchall()
+        return [Message.from_json(row[0]) for row in reversed(rows)]
+
+    def load_holdings(self, session_id):
+        self._start()
+        with self._read_lock:
+            row = self._reader.execute("SELECT holdings FROM holdings WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Wait until everything appended so far is on disk
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        with self._read_lock:
+            self._reader.close()
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            # Grab whatever else is already waiting, up to batch_size
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if item is not None]
+            # Each kind of row is written with one executemany, in the order they were queued
+            statements = {}
+            for statement, row in rows:
+                statements.setdefault(statement, []).append(row)
+            try:
+                if rows:
+                    with connection:
+                        for statement, statement_rows in statements.items():
+                            connection.executemany(statement, statement_rows)
+            except sqlite3.Error as e:
+                print_error(f"could not save {len(rows)} messages and holdings: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(rows) != len(batch):
+                connection.close()
+                return
+
+
+# Make the session store the .env file asks for
+# SESSION_STORE is "sqlite" (the default) or "memory", SESSION_DB is where the sqlite file goes
+def open_session_store():
+    kind = os.environ.get("SESSION_STORE", "sqlite").lower()
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.environ.get("SESSION_DB", "stockbroker_sessions.db"))
+    raise ValueError(f"Unknown SESSION_STORE {kind!r}, use sqlite or memory")
@@ -0,0 +1,219 @@
+# A registry of the functions the AI can call
+# Instead of writing the json schema for every function by hand and adding another elif to run it,
+# we put @registry.tool(...) on the function: the schema is made from its type hints when the file is imported,
+# and running a tool call is one dictionary lookup no matter how many tools there are
+# standard python library, everything here is built in
+import asyncio
+import functools
+import inspect
+import json
+import typing
+
+# The json schema type for each python type we support in a tool's parameters
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+# Raised when the AI calls a tool with arguments that do not match its schema
+class ToolArgumentError(ValueError):
+    pass
+
+
+# Turn a python type hint into a json schema, e.g. list[str] -> {"type": "array", "items": {"type": "string"}}
+def type_to_schema(hint):
+    origin = typing.get_origin(hint)
+    if origin in (list, tuple, set):
+        args = typing.get_args(hint)
+        return {"type": "array", "items": type_to_schema(args[0]) if args else {}}
+    if origin is dict:
+        return {"type": "object"}
+    if origin is typing.Literal:
+        return {"type": JSON_TYPES[type(typing.get_args(hint)[0])], "enum": list(typing.get_args(hint))}
+    if origin is typing.Union:
+        # Optional[X] is Union[X, None], the None part just means the parameter can be left out
+        args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+        if len(args) == 1:
+            return type_to_schema(args[0])
+    if hint in JSON_TYPES:
+        return {"type": JSON_TYPES[hint]}
+    raise TypeError(f"Tool parameters can not have type {hint!r}")
+
+
+# Build a function that checks one value against a schema, so the checking work is done once per tool
+def make_checker(schema):
+    kind = schema["type"]
+    if kind == "array":
+        check_item = make_checker(schema["items"]) if schema["items"] else None
+
+        def check(value):
+            if not isinstance(value, list):
+                return False
+            return check_item is None or all(check_item(item) for item in value)
+        return check
+    if kind == "object":
+        return lambda value: isinstance(value, dict)
+    if kind == "integer":
+        # bool is a subclass of int in python, but true/false is not a number in json
+        check = lambda value: isinstance(value, int) and not isinstance(value, bool)
+    elif kind == "number":
+        check = lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif kind == "boolean":
+        check = lambda value: isinstance(value, bool)
+    else:
+        check = lambda value: isinstance(value, str)
+    if "enum" in schema:
+        allowed = set(schema["enum"])
+        return lambda value: check(value) and value in allowed
+    return check
+
+
+class Tool:
+    def __init__(self, function, name, description, params, user_ready, analysis=False):
+        self.function = function
+        self.name = name
+        self.description = description
+        # Whether the output is a sentence we can show the user without the AI rewording it
+        self.user_ready = user_ready
+        # Whether the output is worth handing to the bigger model to explain, see router.py
+        self.analysis = analysis
+        # The async version, if there is one, see ToolRegistry.async_version
+        self.async_function = None
+
+        hints = typing.get_type_hints(function)
+        properties = {}
+        required = []
+        self.checkers = {}
+        for parameter in inspect.signature(function).parameters.values():
+            # Parameters without a type hint are taken to be strings
+            schema = type_to_schema(hints.get(parameter.name, str))
+            if parameter.name in params:
+                schema["description"] = params[parameter.name]
+            properties[parameter.name] = schema
+            self.checkers[parameter.name] = make_checker(schema)
+            if parameter.default is inspect.Parameter.empty:
+                required.append(parameter.name)
+        self.required = required
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": {"type": "object", "properties": properties, "required": required},
+            },
+        }
+
+    # Turn the json string the AI sent into keyword arguments, checking them against the schema on the way
+    def parse_arguments(self, arguments):
+        try:
+            kwargs = json.loads(arguments) if arguments else {}
+        except json.JSONDecodeError as e:
+            raise ToolArgumentError(f"arguments for {self.name} are not valid json: {e}")
+        if not isinstance(kwargs, dict):
+            raise ToolArgumentError(f"arguments for {self.name} must be a json object")
+        for name in self.required:
+            if name not in kwargs:
+                raise ToolArgumentError(f"{self.name} is missing the argument {name}")
+        for name, value in kwargs.items():
+            checker = self.checkers.get(name)
+            if checker is None:
+                raise ToolArgumentError(f"{self.name} has no argument {name}")
+            if not checker(value):
+                raise ToolArgumentError(f"argument {name} of {self.name} has the wrong type")
+        return kwargs
+
+
+# handle_error(name, exception) turns an exception a tool raised into what the tool gives back instead,
+# e.g. an error the AI can explain to the user
+# Every tool and async version is wrapped with it when it is registered, so the error handling is written once,
+# and calling a tool straight from code (not through call) handles errors the same way
+class ToolRegistry:
+    def __init__(self, handle_error=None):
+        self.tools = {}
+        self.handle_error = handle_error
+        # The list we hand out as tools=..., kept up to date as tools are registered
+        self._schemas = []
+
+    # Wrap a function so whatever it raises goes to handle_error
+    def guard(self, function):
+        if self.handle_error is None:
+            return function
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def guarded(*args, **kwargs):
+                try:
+                    return await function(*args, **kwargs)
+                except Exception as e:
+                    return self.handle_error(function.__name__, e)
+            return guarded
+
+        @functools.wraps(function)
+        def guarded(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                return self.handle_error(function.__name__, e)
+        return guarded
+
+    # Decorator that registers a function as a tool
+    # params maps parameter names to the description the AI sees for them
+    def tool(self, description, name=None, user_ready=False, analysis=False, **params):
+        def register(function):
+            tool = Tool(function, name or function.__name__, description, params, user_ready, analysis)
+            tool.function = function = self.guard(function)
+            previous = self.tools.get(tool.name)
+            self.tools[tool.name] = tool
+            # Update the list in place, so anyone holding on to it sees the new tool too
+            if previous is not None:
+                self._schemas[self._schemas.index(previous.schema)] = tool.schema
+            else:
+                self._schemas.append(tool.schema)
+            return function
+        return register
+
+    # Decorator that registers the async version of a tool we already have
+    def async_version(self, function):
+        tool = self.tools[function.__name__]
+
+        def register(async_function):
+            tool.async_function = async_function = self.guard(async_function)
+            return async_function
+        return register
+
+    # The list of schemas to send as tools=..., each schema is built once and the list is reused for every api call
+    def schemas(self):
+        return self._schemas
+
+    def is_user_ready(self, name):
+        tool = self.tools.get(name)
+        return tool is not None and tool.user_ready
+
+    def is_analysis(self, name):
+        tool = self.tools.get(name)
+        return tool is not None and tool.analysis
+
+    # Find the tool for a tool call and check its arguments
+    # Problems come back as an error string instead of an exception, so the AI can see what went wrong
+    def _prepare(self, tool_call):
+        tool = self.tools.get(tool_call.function.name)
+        if tool is None:
+            return None, f"Error: function {tool_call.function.name} does not exist"
+        try:
+            return tool, tool.parse_arguments(tool_call.function.arguments)
+        except ToolArgumentError as e:
+            return None, f"Error: {e}"
+
+    # Run a tool call and return its output
+    def call(self, tool_call):
+        tool, kwargs = self._prepare(tool_call)
+        if tool is None:
+            return kwargs
+        return tool.function(**kwargs)
+
+    # Run a tool call from async code
+    # Tools without an async version run in a thread, so they don't hold up the event loop
+    async def call_async(self, tool_call):
+        tool, kwargs = self._prepare(tool_call)
+        if tool is None:
+            return kwargs
+        if tool.async_function is not None:
+            return await tool.async_function(**kwargs)
+        return await asyncio.to_thread(tool.function, **kwargs)
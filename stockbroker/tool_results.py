@@ -0,0 +1,224 @@
+# What the functions the AI can call give back
+# Each result keeps its numbers as numbers, so the rest of the code (the router, the portfolio, metrics)
+# can use them without reading them back out of a sentence. A result only becomes text at the edges:
+# to_json() is what the AI sees, sent as compact json, and str() is the sentence we can show the user
+# standard python library
+import json
+import math
+
+# Why a function failed, the AI sees the code so it can explain what went wrong
+RATE_LIMITED = "rate_limited"
+UPSTREAM_ERROR = "upstream_error"
+UNKNOWN_SYMBOL = "unknown_symbol"
+BAD_ARGUMENTS = "bad_arguments"
+NO_DATA = "no_data"
+FAILED = "failed"
+
+
+# Round a worked out number to 8 significant digits, which keeps the cents on a million dollars but drops
+# the long tails like 0.30000000000000004 that only cost tokens. Prices straight from the api are sent as they came
+# nan (a number we could not work out) becomes None, which is null in json
+def compact(number):
+    if number is None or math.isnan(number):
+        return None
+    return float(f"{number:.8g}")
+
+
+# A price as the api sent it, or None if there is no price for the coin right now
+def raw_price(price):
+    price = float(price)
+    return None if math.isnan(price) else price
+
+
+# Leave out the fields that have no value, they only cost tokens
+def drop_empty(fields):
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+class ToolResult:
+    # The error code if the function failed, None if it worked
+    error = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    # The fields the AI sees
+    def to_json(self):
+        raise NotImplementedError
+
+
+# A function that did not work
+# message, if given, is shown to the user and the AI as "Error: message", e.g. when to try again
+class ToolError(ToolResult):
+    def __init__(self, error, message=None, retry_after=None):
+        self.error = error
+        self.message = message
+        self.retry_after = retry_after
+
+    def to_json(self):
+        return drop_empty({"error": self.error, "message": self.message, "retry_after": self.retry_after})
+
+    def __str__(self):
+        return f"Error: {self.message}" if self.message else "The function failed to run"
+
+
+# The price of one coin
+# timestamp is when the price last changed in unix seconds, source is the exchange it came from
+class Quote(ToolResult):
+    def __init__(self, symbol, price, timestamp=None, source=None, name=None, currency="USD"):
+        self.symbol = symbol
+        self.price = price
+        self.timestamp = timestamp
+        self.source = source
+        self.name = name
+        self.currency = currency
+
+    # Make a quote from the RAW section the price api sends for a coin
+    @classmethod
+    def from_raw(cls, symbol, raw_data, name=None, exchange=None):
+        return cls(symbol, raw_data["PRICE"], raw_data.get("LASTUPDATE"), raw_data.get("LASTMARKET") or exchange,
+                   name, raw_data.get("TOSYMBOL", "USD"))
+
+    def to_json(self):
+        return drop_empty({"symbol": self.symbol, "price": self.price, "currency": self.currency,
+                           "time": self.timestamp, "source": self.source})
+
+    def __str__(self):
+        return f"The price of {self.name or self.symbol} is ${self.price}"
+
+
+# The prices of several coins, in the order they were asked for
+# Each one is a Quote, or a ToolError if that coin could not be priced
+class Quotes(ToolResult):
+    def __init__(self, quotes):
+        self.quotes = quotes
+        # One missing price is enough for the AI to have to explain it, so the whole result counts as failed
+        self.error = next((quote.error for quote in quotes if quote.failed), None)
+
+    def to_json(self):
+        return {"quotes": [quote.to_json() for quote in self.quotes]}
+
+    def __str__(self):
+        return "\n".join(str(quote) for quote in self.quotes)
+
+
+# How a coin's price moved over a stretch of its history
+class HistorySummary(ToolResult):
+    def __init__(self, symbol, interval, candles, first_open, last_close, high, low):
+        self.symbol = symbol
+        self.interval = interval
+        self.candles = candles
+        self.first_open = first_open
+        self.last_close = last_close
+        self.high = high
+        self.low = low
+        self.change = (last_close - first_open) / first_open * 100 if first_open else 0.0
+
+    def to_json(self):
+        return {"symbol": self.symbol, "interval": self.interval, "candles": self.candles,
+                "open": compact(self.first_open), "close": compact(self.last_close), "change_pct": compact(self.change),
+                "high": compact(self.high), "low": compact(self.low)}
+
+    def __str__(self):
+        return (f"Over the last {self.candles} {self.interval}s {self.symbol} went from ${self.first_open:,.2f} "
+                f"to ${self.last_close:,.2f} ({self.change:+.2f}%), with a high of ${self.high:,.2f} "
+                f"and a low of ${self.low:,.2f}")
+
+
+# The latest values of a technical indicator, e.g. {"rsi": 61.2} or {"macd": ..., "signal": ..., "histogram": ...}
+class IndicatorValue(ToolResult):
+    def __init__(self, symbol, indicator, interval, period, values):
+        self.symbol = symbol
+        self.indicator = indicator
+        self.interval = interval
+        self.period = period
+        self.values = values
+
+    def to_json(self):
+        fields = {"symbol": self.symbol, "indicator": self.indicator, "interval": self.interval}
+        # MACD always uses the same periods, so its period would only confuse the AI
+        if self.indicator != "macd":
+            fields["period"] = self.period
+        fields.update((name, compact(value)) for name, value in self.values.items())
+        return fields
+
+    def __str__(self):
+        symbol, interval, period, values = self.symbol, self.interval, self.period, self.values
+        if self.indicator == "sma":
+            return f"The {period} {interval} simple moving average of {symbol} is ${values['sma']:,.2f}"
+        if self.indicator == "ema":
+            return f"The {period} {interval} exponential moving average of {symbol} is ${values['ema']:,.2f}"
+        if self.indicator == "rsi":
+            return (f"The {period} {interval} RSI of {symbol} is {values['rsi']:.1f} "
+                    f"(above 70 is usually read as overbought, below 30 as oversold)")
+        if self.indicator == "macd":
+            return (f"The MACD (12, 26, 9) of {symbol} on {interval} candles is {values['macd']:,.4f}, "
+                    f"its signal line is {values['signal']:,.4f} and the histogram is {values['histogram']:,.4f}")
+        if self.indicator == "bollinger":
+            return (f"The {period} {interval} Bollinger bands of {symbol} run from ${values['lower']:,.2f} "
+                    f"to ${values['upper']:,.2f}, around a middle of ${values['middle']:,.2f}")
+        return f"The yearly volatility of {symbol} over the last {period} {interval}s is {values['volatility']:.1%}"
+
+
+# One holding in a valued portfolio, the numbers we could not work out (e.g. no price right now) are None
+class Holding:
+    def __init__(self, symbol, amount, price, value, weight, profit):
+        self.symbol = symbol
+        self.amount = amount
+        self.price = price
+        self.value = value
+        self.weight = weight
+        self.profit = profit
+
+    def to_json(self):
+        return drop_empty({"symbol": self.symbol, "amount": self.amount, "price": self.price,
+                           "value": compact(self.value), "weight": compact(self.weight), "profit": compact(self.profit)})
+
+    def __str__(self):
+        if self.value is None:
+            return f"{self.symbol}: {self.amount:g}, the price is not available right now"
+        line = (f"{self.symbol}: {self.amount:g} at ${self.price:,.2f} = ${self.value:,.2f} "
+                f"({self.weight:.1%} of the portfolio)")
+        if self.profit is not None:
+            line += f", profit ${self.profit:,.2f}"
+        return line
+
+
+# A valued portfolio: every holding, the total, and the profit if we know what the user paid
+class PortfolioValuation(ToolResult):
+    def __init__(self, holdings, total, total_profit=None, total_cost=None):
+        self.holdings = holdings
+        self.total = total
+        self.total_profit = total_profit
+        self.total_cost = total_cost
+
+    # Make one from what Portfolio.valuation() works out
+    @classmethod
+    def from_valuation(cls, valuation):
+        holdings = [Holding(code, float(valuation["amounts"][row]), raw_price(valuation["prices"][row]),
+                            compact(float(valuation["values"][row])), compact(float(valuation["weights"][row])),
+                            compact(float(valuation["profit"][row])))
+                    for row, code in enumerate(valuation["codes"])]
+        return cls(holdings, valuation["total"], valuation["total_profit"], valuation["total_cost"])
+
+    def to_json(self):
+        return drop_empty({"holdings": [holding.to_json() for holding in self.holdings], "total": compact(self.total),
+                           "total_profit": compact(self.total_profit)})
+
+    def __str__(self):
+        if not self.holdings:
+            return "The portfolio is empty"
+        total = f"Total: ${self.total:,.2f}"
+        if self.total_profit is not None:
+            profit_share = self.total_profit / self.total_cost if self.total_cost else 0.0
+            total += f", profit ${self.total_profit:,.2f} ({profit_share:+.1%})"
+        return "\n".join([str(holding) for holding in self.holdings] + [total])
+
+
+# What goes in the content of the function message the AI reads
+# Results become compact json, anything else (like the registry's own error messages) is already text
+def to_content(result):
+    if isinstance(result, ToolResult):
+        return json.dumps(result.to_json(), separators=(",", ":"))
+    return str(result)
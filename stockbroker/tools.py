@@ -0,0 +1,497 @@
+# Every function the AI can call, and the code that runs the AI's tool calls
+# standard python library, lets us run several tool calls at the same time
+from concurrent.futures import ThreadPoolExecutor
+# standard python library, lets one program handle many conversations at the same time
+import asyncio
+# standard python library, lets the threads running tool calls know which turn they belong to
+import contextvars
+import os
+# standard python library, lets a tool parameter only take a few values
+from typing import Literal, Optional
+
+# The big packages are only imported the first time they are used, see lazy.py
+from .lazy import lazy_import, once
+# The shared price cache, see price_cache.py
+from .price_cache import price_cache
+# Every api call goes through one shared session with timeouts and retries, see http_client.py
+from .http_client import http_get, async_http_get
+# Raised when an api is too busy to answer in time, see rate_limit.py
+from .rate_limit import RateLimited
+# What the functions give back, numbers the rest of the code can use that only become text for the AI or the user
+from .tool_results import (Quote, Quotes, ToolError, ToolResult, HistorySummary, IndicatorValue, PortfolioValuation,
+                           to_content, RATE_LIMITED, UPSTREAM_ERROR, UNKNOWN_SYMBOL, BAD_ARGUMENTS, NO_DATA, FAILED)
+# Errors are printed through the display like every message, see display.py
+from .display import print_error
+# Times every api call and function call, see tracing.py
+from .tracing import span
+# The function messages we add to the conversation, see messages.py
+from .messages import Message
+# Keeps track of the functions the AI can call, see tool_registry.py
+from .tool_registry import ToolRegistry
+# Keeps the prices people ask about up to date in the background, see price_feed.py
+from .price_feed import open_price_feed
+# Saves price history on disk so we only ever fetch the candles we don't have, see price_history.py
+from .price_history import open_price_history, history_urls, parse_bars, merge_bars, INTERVALS
+# Moving averages, RSI and the like, worked out from the price history, see indicators.py
+from .indicators import IndicatorEngine
+# The holdings each session tells us about, see portfolio.py
+from .portfolio import Portfolio
+
+# pip install requests
+requests = lazy_import("requests")
+# installed with openai, the async http client the async price functions use
+httpx = lazy_import("httpx")
+# pip install numpy, used to sum up a price history
+np = lazy_import("numpy")
+
+# Where the price api lives
+CRYPTOCOMPARE_URL = os.environ.get("CRYPTOCOMPARE_URL", "https://min-api.cryptocompare.com")
+
+
+# What a function gives back when it raised instead of answering, the registry calls this for every function
+# The AI gets an error it can explain to the user, instead of the whole turn failing
+def tool_error(name, exception):
+    # Too busy to ask the api in time, the message says when to try again
+    if isinstance(exception, RateLimited):
+        return ToolError(RATE_LIMITED, str(exception), exception.retry_after)
+    # The api failed or could not be reached, the sync functions use requests and the async ones httpx
+    if isinstance(exception, (requests.exceptions.RequestException, httpx.HTTPError)):
+        print_error(str(exception))
+        return ToolError(UPSTREAM_ERROR)
+    print_error(f"{name} failed: {exception}")
+    return ToolError(FAILED)
+
+
+# Every function the AI can call gets registered here with @tool_registry.tool(...)
+tool_registry = ToolRegistry(handle_error=tool_error)
+# The api only takes so many codes in one pricemultifull request, more than this are asked for in chunks
+MAX_CODES_PER_REQUEST = 50
+# The most coins get_crypto_prices looks up one by one at the same time
+# Any more threads than the http connection pool has would only wait for a connection
+max_price_threads = int(os.environ.get("HTTP_POOL_SIZE", 10))
+
+
+# The pricemultifull urls for a list of codes, one for every MAX_CODES_PER_REQUEST of them
+# The api wants the codes as one comma separated string, e.g. BTC,ETH,SOL
+def price_urls(currency_codes):
+    return [f"{CRYPTOCOMPARE_URL}/data/pricemultifull?fsyms={','.join(currency_codes[start:start + MAX_CODES_PER_REQUEST])}"
+            f"&tsyms=USD&e=coinbase" for start in range(0, len(currency_codes), MAX_CODES_PER_REQUEST)]
+
+
+# Pull the USD prices out of a pricemultifull answer, and save them in the cache so the next question about them is free
+# The raw section of the data is keyed by coin code and then by the currency we asked for
+def cache_prices(data, prices):
+    for currency_code, raw_data in (data.get("RAW") or {}).items():
+        if "USD" in raw_data:
+            price_cache.set((currency_code, "USD", "coinbase"), raw_data["USD"])
+            prices[currency_code] = raw_data["USD"]
+
+
+# Fetch the raw price data for one currency pair from the api
+# Every price function goes through here, so we can put the cache in front of it
+# Answers are cached by (fsym, tsym, exchange), so asking for the same coin twice within the ttl only calls the api once
+def fetch_price(fsym, tsym="USD", exchange="coinbase"):
+    # A coin the price feed is watching is answered from the feed, with no waiting at all
+    raw_data = feed_quote(fsym, tsym, exchange)
+    if raw_data:
+        return raw_data
+
+    def fetch():
+        # The url for our api
+        api_url = f"{CRYPTOCOMPARE_URL}/data/generateAvg?fsym={fsym}&tsym={tsym}&e={exchange}"
+        # Call the api to get the data
+        response = http_get(api_url)
+        data = response.json()
+        # Grab the raw section of the data, this is None if the api did not know the coin
+        return data.get("RAW")
+    return price_cache.get_or_fetch((fsym, tsym, exchange), fetch)
+
+
+# Our api call where we get the current price of bitcoin
+# The decorator registers it as a tool, its description is what the AI sees
+@tool_registry.tool("Returns the current price of bitcoin", user_ready=True)
+def get_bitcoin_price():
+    # Get the data, either from the cache or from the api
+    raw_data = fetch_price("BTC")
+    # If the raw data exists, return the price
+    if raw_data:
+        return Quote.from_raw("BTC", raw_data, name="bitcoin", exchange="coinbase")
+    # The api did not know the coin
+    return ToolError(UNKNOWN_SYMBOL)
+
+# Our new funciton
+# Get the price of any cryptocurrency, given the currency name and the code
+# The parameter descriptions go in the decorator, and the types come from the type hints
+@tool_registry.tool("Returns the current price of a cryptocurrency given its name and code", user_ready=True,
+                    currency="The name of the cryptocurrency, e.g., Bitcoin",
+                    currency_code="The code of the cryptocurrency, e.g., BTC")
+def get_crypto_price(currency: str, currency_code: str):
+    # Instead of hardcoding the currency code, we can pass it as a parameter
+    raw_data = fetch_price(currency_code)
+    # If the raw data exists, return the price
+    if raw_data:
+        # Keep the currency name, so the sentence we show the user says the right one
+        return Quote.from_raw(currency_code, raw_data, name=currency, exchange="coinbase")
+    return ToolError(UNKNOWN_SYMBOL)
+
+
+# Get the raw price data of many coins with as few requests as we can, as {code: raw data}
+# Coins the price feed is watching, or that we looked up recently, are answered straight away,
+# and all the others are asked for together, MAX_CODES_PER_REQUEST at a time
+# Coins the api did not know, or every coin in a request that failed, are left out
+def fetch_prices(currency_codes):
+    prices = {}
+    for currency_code in currency_codes:
+        raw_data = feed_quote(currency_code) or price_cache.get((currency_code, "USD", "coinbase"))
+        if raw_data:
+            prices[currency_code] = raw_data
+    uncached = [currency_code for currency_code in dict.fromkeys(currency_codes) if currency_code not in prices]
+    for api_url in price_urls(uncached):
+        try:
+            # Call the api to get the data for every coin in this chunk
+            cache_prices(http_get(api_url).json(), prices)
+        # Error handling
+        except requests.exceptions.RequestException as e:
+            print_error(str(e))
+        except Exception as ex:
+            print_error(f"could not get prices: {ex}")
+    return prices
+
+
+# Get the price of many cryptocurrencies at once, given a list of codes
+# This makes one request for every coin instead of one request per coin, which matters for big portfolios
+@tool_registry.tool("Returns the current prices of several cryptocurrencies at once given their codes. "
+                    "Use this instead of get_crypto_price when asked about more than one cryptocurrency, e.g. a portfolio",
+                    user_ready=True,
+                    currency_codes='The codes of the cryptocurrencies, e.g., ["BTC", "ETH", "SOL"]')
+def get_crypto_prices(currency_codes: list[str]):
+    prices = {currency_code: Quote.from_raw(currency_code, raw_data, exchange="coinbase")
+              for currency_code, raw_data in fetch_prices(currency_codes).items()}
+    # If the batch request failed, or left some coins out, fall back to asking for each missing coin
+    # We ask for up to max_price_threads of them at the same time, so a few missing coins only cost about one request of waiting
+    missing = [currency_code for currency_code in dict.fromkeys(currency_codes) if currency_code not in prices]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), max_price_threads)) as executor:
+            results = executor.map(get_crypto_price, missing, missing)
+            prices.update(zip(missing, results))
+    # Keep the prices in the same order the AI asked for them
+    return Quotes([prices[currency_code] for currency_code in currency_codes])
+
+
+# Every candle we have fetched, saved on disk
+price_history = open_price_history()
+# Remembers where each indicator got to, so new candles are the only ones it has to work through
+indicator_engine = IndicatorEngine()
+
+
+# A function that fetches the candles from start to end for the price history, see PriceHistory.get
+def history_fetcher(currency_code, interval):
+    def fetch(start, end):
+        chunks = [parse_bars(http_get(url).json(), start, end)
+                  for url in history_urls(CRYPTOCOMPARE_URL, currency_code, interval, start, end)]
+        return merge_bars(chunks)
+    return fetch
+
+
+# Sum up a price history, e.g. how much a coin went up over the last week
+def summarize_history(currency_code, interval, bars):
+    if not len(bars["close"]):
+        return ToolError(NO_DATA)
+    return HistorySummary(currency_code, interval, len(bars["close"]), float(bars["open"][0]), float(bars["close"][-1]),
+                          float(np.max(bars["high"])), float(np.min(bars["low"])))
+
+
+# Get the price history of a cryptocurrency
+# The first question about a coin fetches the whole window, after that we only fetch the candles that finished since
+@tool_registry.tool("Returns how the price of a cryptocurrency changed over a recent period, e.g. the last 7 days",
+                    user_ready=True, analysis=True,
+                    currency_code="The code of the cryptocurrency, e.g., ETH",
+                    interval="The size of each step in the history",
+                    window="How many steps of history to look at, e.g. 7 with interval day for the last week")
+def get_price_history(currency_code: str, interval: Literal["minute", "hour", "day"] = "day", window: int = 7):
+    # The api only gives 2000 candles at once, and nobody needs more than a few requests worth
+    window = max(1, min(window, 10000))
+    bars = price_history.get(currency_code, interval, window, history_fetcher(currency_code, interval))
+    return summarize_history(currency_code, interval, bars)
+
+
+# How many candles an indicator is worked out over
+# The exponential ones need plenty of history before they settle, the rest only need `period` candles
+def indicator_window(period):
+    return max(200, 10 * period)
+
+
+# An indicator's latest values, or an error if there was not enough history to work it out
+def indicator_result(currency_code, indicator, interval, period, values):
+    if values is None:
+        return ToolError(NO_DATA)
+    return IndicatorValue(currency_code, indicator, interval, period, values)
+
+
+# Work out a technical indicator from the saved price history
+# The history only fetches candles we don't have, and the engine only works through candles it has not seen
+@tool_registry.tool("Returns a technical indicator of a cryptocurrency worked out from its price history: "
+                    "simple or exponential moving average, RSI, MACD, Bollinger bands or realized volatility",
+                    user_ready=True, analysis=True,
+                    currency_code="The code of the cryptocurrency, e.g., ETH",
+                    indicator="The indicator to work out",
+                    interval="The size of each step in the price history",
+                    period="How many steps the indicator looks at, e.g. 14 for a 14 day RSI. MACD always uses 12, 26 and 9")
+def get_technical_indicator(currency_code: str,
+                            indicator: Literal["sma", "ema", "rsi", "macd", "bollinger", "volatility"],
+                            interval: Literal["minute", "hour", "day"] = "day", period: int = 14):
+    period = max(2, min(period, 1000))
+    bars = price_history.get(currency_code, interval, indicator_window(period),
+                             history_fetcher(currency_code, interval))
+    values = indicator_engine.latest((currency_code, interval), indicator, bars["time"], bars["close"],
+                                     period, INTERVALS[interval])
+    return indicator_result(currency_code, indicator, interval, period, values)
+
+
+# The portfolio of the session that is running right now
+# Code running outside a turn (e.g. calling the tool by hand) shares one portfolio
+@once
+def default_portfolio():
+    return Portfolio()
+
+
+def session_portfolio():
+    session = current_session.get()
+    return session.portfolio if session is not None else default_portfolio()
+
+
+# Check the holdings the AI sent and add them to the portfolio, returns an error if they don't add up
+def update_portfolio(portfolio, currency_codes, amounts, cost_basis, replace):
+    currency_codes = currency_codes or []
+    amounts = amounts or []
+    if len(currency_codes) != len(amounts):
+        return ToolError(BAD_ARGUMENTS, "currency_codes and amounts must be the same length")
+    if cost_basis is not None and len(cost_basis) != len(currency_codes):
+        return ToolError(BAD_ARGUMENTS, "cost_basis must have one price for every currency code")
+    if any(amount < 0 for amount in amounts):
+        return ToolError(BAD_ARGUMENTS, "amounts can not be negative")
+    if replace:
+        portfolio.remove(list(portfolio.codes))
+    portfolio.update([code.upper() for code in currency_codes], amounts, cost_basis)
+    if replace or currency_codes:
+        portfolio.changed()
+    return None
+
+
+# Value the user's portfolio
+# The holdings are kept for the whole conversation, so later turns can revalue it without listing them again,
+# and only coins whose price is out of date are priced, all of them with one request
+@tool_registry.tool("Values the user's cryptocurrency portfolio: the value, weight and profit of each holding and the total. "
+                    "Holdings are remembered for the rest of the conversation, so only pass the ones that are new or changed, "
+                    "or nothing at all to revalue the portfolio",
+                    user_ready=True, analysis=True,
+                    currency_codes='The codes of the holdings to add or change, e.g., ["BTC", "ETH"]',
+                    amounts="How much of each coin the user holds, in the same order. 0 removes a coin",
+                    cost_basis="What the user paid for one of each coin in USD, in the same order, if they said",
+                    replace="True to throw away the remembered holdings first, e.g. when the user lists their whole portfolio again")
+def value_portfolio(currency_codes: Optional[list[str]] = None, amounts: Optional[list[float]] = None,
+                    cost_basis: Optional[list[float]] = None, replace: bool = False):
+    portfolio = session_portfolio()
+    error = update_portfolio(portfolio, currency_codes, amounts, cost_basis, replace)
+    if error:
+        return error
+    portfolio.set_prices({code: raw_data["PRICE"]
+                          for code, raw_data in fetch_prices(portfolio.stale(price_cache.ttl)).items()})
+    return PortfolioValuation.from_valuation(portfolio.valuation())
+
+
+# Run a single tool call inside a timing span
+# The registry looks up the function by name, checks the arguments the AI sent and calls it
+def timed_tool_call(tool_call):
+    with span("tool", tool=tool_call.function.name):
+        return tool_registry.call(tool_call)
+
+
+# Function where we execute the function calls
+# The AI can ask for several functions in one message (e.g. the price of BTC, ETH and SOL),
+# so we run every tool call at the same time instead of one after another
+def execute_function_call(message):
+    tool_calls = message.tool_calls
+    # Threads don't share our context, so give each one a copy, that way its spans know which turn they belong to
+    contexts = [contextvars.copy_context() for _ in tool_calls]
+    # Each tool call gets its own thread, so the slow part (waiting on the api) overlaps
+    with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+        # map keeps the results in the same order as the tool calls
+        results = list(executor.map(lambda context, tool_call: context.run(timed_tool_call, tool_call),
+                                    contexts, tool_calls))
+    return [message.to_dict() for message in function_messages(tool_calls, results)]
+
+
+# Create one response message per tool call
+# This includes the tool call id, the function name, and the results of the function
+# The results only become text here, as compact json the AI reads
+# execute_function_call gives them back as plain dictionaries, for code that sends them with the openai library itself
+def function_messages(tool_calls, results):
+    return [Message("function", to_content(result), tool_call_id=tool_call.id, name=tool_call.function.name)
+            for tool_call, result in zip(tool_calls, results)]
+
+
+# The price feed refreshes every coin it watches with one pricemultifull request (or a few, for a lot of coins)
+# It is the same request get_crypto_prices makes, just done in the background
+async def fetch_feed_quotes(currency_codes):
+    # The api only takes so many codes at once, so ask for them in chunks, all at the same time
+    responses = await asyncio.gather(*(async_http_get(api_url) for api_url in price_urls(currency_codes)))
+    quotes = {}
+    for response in responses:
+        raw_data = response.json().get("RAW") or {}
+        quotes.update((code, prices["USD"]) for code, prices in raw_data.items() if "USD" in prices)
+    return quotes
+
+
+# The price feed, or None if PRICE_FEED=false in the .env file
+price_feed = open_price_feed(fetch_feed_quotes)
+# The session the code running right now belongs to, handle_turn sets it, so the functions know who is asking
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+# The feed's latest price for a coin, or None
+# The feed only watches prices in USD on coinbase, which is what every price function asks for
+def feed_quote(fsym, tsym="USD", exchange="coinbase"):
+    if price_feed is None or tsym != "USD" or exchange != "coinbase":
+        return None
+    return price_feed.quote(fsym)
+
+
+# Tell the price feed the current session cares about these coins
+# Only async code running inside a turn subscribes, since the feed lives on the event loop
+def watch_prices(currency_codes, tsym="USD", exchange="coinbase"):
+    session = current_session.get()
+    if price_feed is not None and session is not None and tsym == "USD" and exchange == "coinbase":
+        price_feed.subscribe(session.session_id, currency_codes)
+
+
+# List of tools we have
+# The registry made the schemas from the decorators above, so there is nothing to write out by hand
+tools = tool_registry.schemas()
+
+
+# The async versions of our functions
+# These do exactly what the functions above do, but while one of them waits on the api
+# the event loop can get on with every other session instead of sitting idle
+async def fetch_price_async(fsym, tsym="USD", exchange="coinbase"):
+    # Ask the price feed to keep this coin up to date, so the next question about it is answered from the feed
+    watch_prices([fsym], tsym, exchange)
+    raw_data = feed_quote(fsym, tsym, exchange)
+    if raw_data:
+        return raw_data
+
+    async def fetch():
+        api_url = f"{CRYPTOCOMPARE_URL}/data/generateAvg?fsym={fsym}&tsym={tsym}&e={exchange}"
+        response = await async_http_get(api_url)
+        return response.json().get("RAW")
+    # Same cache as the normal functions, so a price fetched by either one is shared
+    return await price_cache.get_or_fetch_async((fsym, tsym, exchange), fetch)
+
+
+@tool_registry.async_version(get_bitcoin_price)
+async def get_bitcoin_price_async():
+    return await get_crypto_price_async("bitcoin", "BTC")
+
+
+@tool_registry.async_version(get_crypto_price)
+async def get_crypto_price_async(currency, currency_code):
+    raw_data = await fetch_price_async(currency_code)
+    if raw_data:
+        return Quote.from_raw(currency_code, raw_data, name=currency, exchange="coinbase")
+    return ToolError(UNKNOWN_SYMBOL)
+
+
+# Async version of fetch_prices, it also asks the price feed to keep these coins up to date
+async def fetch_prices_async(currency_codes):
+    watch_prices(currency_codes)
+    prices = {}
+    for currency_code in currency_codes:
+        raw_data = feed_quote(currency_code) or price_cache.get((currency_code, "USD", "coinbase"))
+        if raw_data:
+            prices[currency_code] = raw_data
+    uncached = [currency_code for currency_code in dict.fromkeys(currency_codes) if currency_code not in prices]
+
+    async def fetch(api_url):
+        try:
+            cache_prices((await async_http_get(api_url)).json(), prices)
+        except httpx.HTTPError as e:
+            print_error(str(e))
+        except Exception as ex:
+            print_error(f"could not get prices: {ex}")
+    # Every chunk is asked for at the same time
+    await asyncio.gather(*(fetch(api_url) for api_url in price_urls(uncached)))
+    return prices
+
+
+@tool_registry.async_version(get_crypto_prices)
+async def get_crypto_prices_async(currency_codes):
+    prices = {currency_code: Quote.from_raw(currency_code, raw_data, exchange="coinbase")
+              for currency_code, raw_data in (await fetch_prices_async(currency_codes)).items()}
+    # Fall back to one request per missing coin, all of them at the same time
+    missing = [currency_code for currency_code in dict.fromkeys(currency_codes) if currency_code not in prices]
+    if missing:
+        results = await asyncio.gather(*(get_crypto_price_async(code, code) for code in missing))
+        prices.update(zip(missing, results))
+    return Quotes([prices[currency_code] for currency_code in currency_codes])
+
+
+def history_fetcher_async(currency_code, interval):
+    async def fetch(start, end):
+        responses = await asyncio.gather(*(
+            async_http_get(url) for url in history_urls(CRYPTOCOMPARE_URL, currency_code, interval, start, end)))
+        return merge_bars([parse_bars(response.json(), start, end) for response in responses])
+    return fetch
+
+
+@tool_registry.async_version(get_price_history)
+async def get_price_history_async(currency_code, interval="day", window=7):
+    window = max(1, min(window, 10000))
+    bars = await price_history.get_async(currency_code, interval, window,
+                                         history_fetcher_async(currency_code, interval))
+    return summarize_history(currency_code, interval, bars)
+
+
+@tool_registry.async_version(get_technical_indicator)
+async def get_technical_indicator_async(currency_code, indicator, interval="day", period=14):
+    period = max(2, min(period, 1000))
+    bars = await price_history.get_async(currency_code, interval, indicator_window(period),
+                                         history_fetcher_async(currency_code, interval))
+    values = indicator_engine.latest((currency_code, interval), indicator, bars["time"], bars["close"],
+                                     period, INTERVALS[interval])
+    return indicator_result(currency_code, indicator, interval, period, values)
+
+
+@tool_registry.async_version(value_portfolio)
+async def value_portfolio_async(currency_codes=None, amounts=None, cost_basis=None, replace=False):
+    portfolio = session_portfolio()
+    error = update_portfolio(portfolio, currency_codes, amounts, cost_basis, replace)
+    if error:
+        return error
+    # The price feed keeps every coin in the portfolio up to date, so revaluing it later costs no requests at all
+    watch_prices(portfolio.codes)
+    portfolio.set_prices({code: raw_data["PRICE"]
+                          for code, raw_data in (await fetch_prices_async(portfolio.stale(price_cache.ttl))).items()})
+    return PortfolioValuation.from_valuation(portfolio.valuation())
+
+
+async def timed_tool_call_async(tool_call):
+    with span("tool", tool=tool_call.function.name):
+        return await tool_registry.call_async(tool_call)
+
+
+# Run every tool call in a message at the same time, returns what each function gave back, in order
+async def run_tool_calls_async(message):
+    return await asyncio.gather(*(timed_tool_call_async(tool_call) for tool_call in message.tool_calls))
+
+
+# Async version of execute_function_call
+async def execute_function_call_async(message):
+    return [response.to_dict() for response in function_messages(message.tool_calls, await run_tool_calls_async(message))]
+
+
+# Check if a function's output says that it failed, in which case the AI should explain it rather than us
+# The registry's own errors (like a function that does not exist) are plain text
+def tool_failed(result):
+    if isinstance(result, ToolResult):
+        return result.failed
+    return "The function failed to run" in result or result.startswith("Error:")
@@ -0,0 +1,160 @@
+# Timing spans for the conversation pipeline
+# Wrap a piece of work in `with span("name"):` and we record how long it took
+# Spans started inside another span (even across awaits and asyncio.gather) remember their parent,
+# so every api call and function call can be traced back to the turn it belonged to
+# Finished spans are handed to every exporter: we always keep Prometheus style metrics in memory,
+# and if TRACE_FILE is set every span is also written to that file as one line of json
+# standard python library, everything here is built in
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# The span we are currently inside of, if any
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+# Upper bounds (in seconds) of the buckets for the duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        # Every span in one turn shares the trace id of the span at the top
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+
+    # Add details we only know once the work is done, e.g. the status code of a response
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+# Counters and histograms in the Prometheus text format
+# Every span adds to a duration histogram for its name, and token usage adds to the token counters
+class Metrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        # span name -> [count per bucket..., count, sum of durations]
+        self.histograms = {}
+        # (metric name, sorted labels) -> value
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    # The exporter: called with every finished span
+    def __call__(self, span):
+        self.observe(span.name, span.duration)
+        attributes = span.attributes
+        if "error" in attributes:
+            self.inc("stockbroker_span_errors_total", span=span.name, error=attributes["error"])
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if attributes.get(kind):
+                self.inc("stockbroker_llm_tokens_total", attributes[kind],
+                         model=attributes.get("model", ""), type=kind[:-len("_tokens")])
+
+    # Everything we have so far, in the text format Prometheus scrapes
+    def render(self):
+        lines = ["# TYPE stockbroker_span_duration_seconds histogram"]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'stockbroker_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'stockbroker_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'stockbroker_span_duration_seconds_count{{span="{name}"}} {histogram[-2]}')
+                lines.append(f'stockbroker_span_duration_seconds_sum{{span="{name}"}} {histogram[-1]}')
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Writes every span to a file, one json object per line
+class JsonLinesExporter:
+    def __init__(self, path):
+        # Line buffered, so a crash loses at most the span being written
+        self.file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+
+
+metrics = Metrics()
+exporters = [metrics]
+if os.environ.get("TRACE_FILE"):
+    exporters.append(JsonLinesExporter(os.environ["TRACE_FILE"]))
+
+
+# Send finished spans somewhere else too, exporter is any function that takes a Span
+def add_exporter(exporter):
+    exporters.append(exporter)
+
+
+@contextmanager
+def span(name, **attributes):
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        for exporter in exporters:
+            exporter(current)
+
+
+# Copy the token usage of an api call onto its span
+# usage is completion.usage, or the plain dict a streamed reply sends in its last chunk
+def record_usage(current, usage):
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        current.set(**{key: usage.get(key) for key in ("prompt_tokens", "completion_tokens", "total_tokens")})
+    else:
+        current.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                    total_tokens=usage.total_tokens)